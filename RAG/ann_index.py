@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import numpy as np
+
+from vector_search import normalize_rows, top_k_indices
+
+# === IVF 近似最近鄰索引（純 NumPy）===
+# 先用 k-means 把文件向量分成 nlist 個群（倒排清單），
+# 查詢時只掃描離 query 最近的 nprobe 個群。
+# nprobe 越大 → recall 越高、延遲越長；nprobe == nlist 時等同精確搜尋。
+
+BLOCK_ROWS = 16384  # 分配群時一次處理的列數：暫存的距離矩陣只有 BLOCK_ROWS × nlist
+
+
+def nearest_centroid(data, centroids):
+    """每個向量最近的中心點編號；分批計算，不會建出 N × k 的距離矩陣"""
+    # ||x - c||² = ||x||² - 2x·c + ||c||²，||x||² 對 argmin 沒影響可省略
+    c_sq = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(data), dtype=np.int64)
+    for s in range(0, len(data), BLOCK_ROWS):
+        assign[s:s + BLOCK_ROWS] = (c_sq - 2 * data[s:s + BLOCK_ROWS] @ centroids.T).argmin(axis=1)
+    return assign
+
+
+def kmeans(data, k, iters=20, seed=0, sample=None):
+    """最基本的 Lloyd k-means；sample 可限制訓練用的樣本數。回傳 (k, d) 中心點"""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if sample is not None and len(data) > sample:
+        data = data[rng.choice(len(data), sample, replace=False)]
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+
+    for _ in range(iters):
+        assign = nearest_centroid(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # 空的群重新隨機挑一個點當中心
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), empty.sum(), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """以 cosine similarity（內積於正規化向量）搜尋的 IVF 索引"""
+
+    def __init__(self, nlist=100, nprobe=8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.vectors = None
+        self.ids = None
+        self.offsets = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    # --- 建立索引 ---
+    def build(self, embeddings, iters=20, seed=0):
+        """訓練中心點並把所有向量依所屬群排序，存成連續的倒排清單"""
+        data = normalize_rows(embeddings)
+        self.centroids = normalize_rows(
+            kmeans(data, self.nlist, iters=iters, seed=seed, sample=max(self.nlist * 256, 10000)))
+        self.nlist = len(self.centroids)
+
+        # 中心點已正規化（||c||² 皆為 1），最近的中心點就是內積最大的
+        assign = nearest_centroid(data, self.centroids)
+        order = np.argsort(assign, kind="stable")
+        self.ids = order.astype(np.int64)
+        self.vectors = np.ascontiguousarray(data[order])
+        counts = np.bincount(assign, minlength=self.nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return self
+
+    # --- 搜尋 ---
+    def search(self, query, top_k=5, nprobe=None):
+        """回傳 (文件索引, 分數)，由高到低排序"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        q = normalize_rows(query)
+        probes = top_k_indices(self.centroids @ q, nprobe)
+
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        sims = self.vectors[rows] @ q
+        best = top_k_indices(sims, top_k)
+        return self.ids[rows[best]], sims[best]
+
+    # --- 存檔 / 讀檔 ---
+    def save(self, directory):
+        """每個陣列存成一個 .npy，讀取時可直接 memory-map"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "ivf.json"), "w", encoding="utf-8") as f:
+            json.dump({"nlist": self.nlist, "nprobe": self.nprobe}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, "ivf.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(nlist=meta["nlist"], nprobe=meta["nprobe"])
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            setattr(index, name, np.load(os.path.join(directory, f"{name}.npy"),
+                                         mmap_mode="r" if mmap else None))
+        return index
+
+
+# === Recall@k 報表 ===
+def recall_report(index, engine, queries, top_k=5, nprobes=(1, 2, 4, 8, 16, 32)):
+    """
+    以 VectorSearchEngine 的精確結果為基準，量測不同 nprobe 的 recall@k 與平均延遲。
+    回傳 list[dict]，方便挑選參數或輸出成 JSON。
+    """
+    queries = np.atleast_2d(queries)
+    exact, _ = engine.search_batch(queries, top_k)
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            found, _ = index.search(q, top_k, nprobe=nprobe)
+            hits += len(set(found.tolist()) & set(truth.tolist()))
+        elapsed = time.perf_counter() - start
+        report.append({
+            "nprobe": nprobe,
+            f"recall@{top_k}": hits / (len(queries) * top_k),
+            "ms_per_query": elapsed * 1000 / len(queries),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from vector_search import VectorSearchEngine
+
+    parser = argparse.ArgumentParser(description="IVF 索引 recall@k 報表（隨機資料）")
+    parser.add_argument("--n", type=int, default=100000, help="文件數")
+    parser.add_argument("--dim", type=int, default=768, help="向量維度")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # 模擬有主題結構的語料：文件圍繞若干主題中心分佈
+    topics = rng.normal(size=(args.nlist, args.dim))
+    data = topics[rng.integers(0, args.nlist, args.n)] + 0.5 * rng.normal(size=(args.n, args.dim))
+    queries = data[rng.choice(args.n, args.queries, replace=False)] + 0.1 * rng.normal(size=(args.queries, args.dim))
+
+    start = time.perf_counter()
+    index = IVFIndex(nlist=args.nlist).build(data)
+    print(f"🏗️ 建立索引：{time.perf_counter() - start:.2f}s（{args.n} 筆，nlist={index.nlist}）")
+
+    engine = VectorSearchEngine(data)
+    for row in recall_report(index, engine, queries, top_k=args.k):
+        print("  " + "  ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
@@ -0,0 +1,97 @@
+import time
+import hashlib
+import numpy as np
+
+from bm25 import tokenize
+
+# === 模型後端 ===
+# RAG 服務只透過兩個方法使用模型：
+#   embed_many(list[str]) → list[向量]
+#   generate(prompt, temperature) → str
+# GeminiBackend 呼叫真正的 API；FakeBackend 在本機產生固定結果，可設定延遲，用來做壓力測試。
+
+
+class GeminiBackend:
+    def __init__(self, embed_model="models/text-embedding-004", gen_model="gemini-2.5-flash"):
+        import google.generativeai as genai
+
+        self.embed_model = embed_model
+        self._genai = genai
+        self._model = genai.GenerativeModel(gen_model)
+
+    def embed_many(self, texts):
+        res = self._genai.embed_content(model=self.embed_model, content=list(texts))
+        return res["embedding"]
+
+    def generate(self, prompt, temperature=0.2):
+        response = self._model.generate_content(prompt, generation_config={"temperature": temperature})
+        return response.text
+
+
+class FakeBackend:
+    """
+    決定性的本機後端：embedding 由文字的 token 雜湊而成（字面相近 → 向量相近），
+    generate 回傳固定格式的文字。embed_latency / generate_latency 模擬每次請求的延遲（秒）。
+    """
+
+    embed_model = "fake-embedding"
+
+    def __init__(self, dim=64, embed_latency=0.0, generate_latency=0.0):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.generate_latency = generate_latency
+        self.embed_calls = 0
+        self.generate_calls = 0
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for tok in tokenize(text) or [text]:
+            h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_many(self, texts):
+        self.embed_calls += 1
+        if self.embed_latency:
+            time.sleep(self.embed_latency)
+        return [self._embed(t) for t in texts]
+
+    def generate(self, prompt, temperature=0.2):
+        self.generate_calls += 1
+        if self.generate_latency:
+            time.sleep(self.generate_latency)
+        return fake_reply(prompt)
+
+    def generative_model(self):
+        """回傳可取代 genai.GenerativeModel 的物件（給 GeminiReranker 等直接呼叫 generate_content 的程式）"""
+        return FakeGenerativeModel(self)
+
+
+def fake_reply(prompt):
+    """rerank prompt 回傳字面重疊度換算的 0-100 分數，其他 prompt 回傳固定文字"""
+    if "FAQ 內容：" in prompt and "問題：" in prompt:
+        query = prompt.split("問題：", 1)[1].split("\n", 1)[0]
+        doc = prompt.split("FAQ 內容：", 1)[1]
+        q, d = set(tokenize(query)), set(tokenize(doc))
+        return str(round(100 * len(q & d) / len(q))) if q else "0"
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    return f"（fake 回覆 {digest}）"
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """介面與 genai.GenerativeModel.generate_content 相同（含 stream=True）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, prompt, generation_config=None, request_options=None, stream=False):
+        text = self.backend.generate(prompt)
+        if stream:
+            return iter([_FakeResponse(text)])
+        return _FakeResponse(text)
@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+# === 批次 + 併發的 Embedding ===
+# Gemini 的 embed_content 接受 list[str]，一次請求最多 100 筆。
+# 這裡把語料切成固定大小的批次，同時最多送出 max_workers 個請求；
+# 失敗的批次各自重試，已成功的批次不會重送。
+
+
+class BatchEmbedError(RuntimeError):
+    """重試後仍有批次失敗；done 記錄已成功的 (起始索引, 向量) 供呼叫端保留"""
+
+    def __init__(self, failed, done):
+        super().__init__(f"{len(failed)} 個批次在重試後仍然失敗")
+        self.failed = failed
+        self.done = done
+
+
+def gemini_embed_many(texts, model="models/text-embedding-004"):
+    """一次請求送出多段文字，回傳每段的向量"""
+    import google.generativeai as genai
+
+    res = genai.embed_content(model=model, content=list(texts))
+    return res["embedding"]
+
+
+class BatchEmbedder:
+    """把 embed_many(list[str]) 包裝成批次、併發、可重試的語料 embedding"""
+
+    def __init__(self, embed_many=gemini_embed_many, batch_size=100, max_workers=4,
+                 max_retries=3, backoff=1.0, verbose=True):
+        self.embed_many = embed_many
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.verbose = verbose
+        self.last_stats = {}
+
+    def _run_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectors = self.embed_many(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"回傳 {len(vectors)} 個向量，預期 {len(texts)} 個")
+                return np.asarray(vectors, dtype=np.float32)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def embed(self, texts, on_batch=None):
+        """
+        回傳 (N, dim) 的 float32 矩陣。
+        on_batch(start, vectors) 會在每個批次完成時（於呼叫端執行緒）被呼叫，
+        可用來邊算邊寫入 EmbeddingStore。
+        """
+        texts = list(texts)
+        starts = range(0, len(texts), self.batch_size)
+        start_time = time.perf_counter()
+        done, failed = {}, []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self._run_batch, texts[s:s + self.batch_size]): s for s in starts
+            }
+            for future in as_completed(futures):
+                s = futures[future]
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    failed.append((s, e))
+                    continue
+                done[s] = vectors
+                if on_batch is not None:
+                    on_batch(s, vectors)
+
+        elapsed = time.perf_counter() - start_time
+        embedded = sum(len(v) for v in done.values())
+        self.last_stats = {
+            "chunks": embedded,
+            "batches": len(done),
+            "failed_batches": len(failed),
+            "seconds": elapsed,
+            "chunks_per_sec": embedded / elapsed if elapsed > 0 else 0.0,
+        }
+        if self.verbose and texts:
+            print(f"⚡ [Embedding] {embedded} 段 / {len(done)} 批，"
+                  f"{self.last_stats['chunks_per_sec']:.1f} chunks/sec")
+
+        if failed:
+            raise BatchEmbedError(failed, done)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate([done[s] for s in starts])
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import numpy as np
+
+from backends import FakeBackend
+from embedding_store import EmbeddingStore
+from batch_embed import BatchEmbedder
+from vector_search import VectorSearchEngine
+from ann_index import IVFIndex, recall_report
+from quantization import QuantizedSearchEngine, quantization_report
+from bm25 import BM25Index
+from reranker import GeminiReranker
+
+# === 離線 RAG 效能測試 ===
+# 全程使用 FakeBackend（決定性的 embedding / 生成，延遲可設定），不呼叫任何 API。
+# 對每個語料大小量測：索引建立時間、記憶體、搜尋 p50/p99 與 QPS、
+# rerank 吞吐量、IVF 與壓縮索引（float16 / int8 / pq）相對精確搜尋的 recall@k 與記憶體，
+# 結果寫成 JSON 方便比較不同版本。
+#
+#   python benchmark.py --sizes 1000,10000,100000 --out bench.json
+#   python benchmark.py --sizes 1000000 --queries 200 --embed-latency 0.05
+
+TOPICS = ["退貨", "退款", "換貨", "配送", "國際配送", "付款", "發票", "會員", "點數", "優惠券",
+          "客服", "保固", "維修", "訂單", "取消訂單", "運費", "門市", "預購", "缺貨", "包裝"]
+ACTIONS = ["如何申請", "需要多久", "有什麼限制", "可以線上辦理嗎", "要準備什麼", "費用怎麼算",
+           "在哪裡查詢", "可以更改嗎", "有期限嗎", "適用哪些商品"]
+OBJECTS = ["手機", "筆電", "耳機", "家電", "服飾", "書籍", "生鮮", "美妝", "家具", "禮品卡"]
+
+
+def synthetic_corpus(n, seed=0):
+    """產生 n 段 Q/A 格式的 FAQ（同一個 seed 結果固定）"""
+    rng = np.random.default_rng(seed)
+    t, a, o = (rng.integers(0, len(x), n) for x in (TOPICS, ACTIONS, OBJECTS))
+    days = rng.integers(1, 31, n)
+    return [
+        f"Q: {OBJECTS[o[i]]}的{TOPICS[t[i]]}{ACTIONS[a[i]]}？（#{i}）\n"
+        f"A: {OBJECTS[o[i]]}類商品的{TOPICS[t[i]]}請於 {days[i]} 天內透過會員中心辦理，編號 {i}。"
+        for i in range(n)
+    ]
+
+
+def synthetic_queries(docs, n, seed=1):
+    """從語料隨機抽問句，去掉編號並換個說法，模擬使用者提問"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(docs), n)
+    return [docs[i].split("\n")[0].removeprefix("Q: ").split("？")[0] + "，請問怎麼處理" for i in picks]
+
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99))}
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 回傳 bytes，Linux 回傳 KB
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def bench_size(n, args):
+    backend = FakeBackend(dim=args.dim, embed_latency=args.embed_latency,
+                          generate_latency=args.generate_latency)
+    docs = synthetic_corpus(n)
+    queries = synthetic_queries(docs, args.queries)
+    result = {"chunks": n, "dim": args.dim}
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        # --- 索引建立（冷啟動：全部 embed）---
+        store = EmbeddingStore(workdir, backend.embed_model)
+        embedder = BatchEmbedder(backend.embed_many, batch_size=100,
+                                 max_workers=args.workers, verbose=False)
+        start = time.perf_counter()
+        embeddings = store.embed_corpus(docs, embedder)
+        result["embed_seconds"] = time.perf_counter() - start
+        result["embed_chunks_per_sec"] = embedder.last_stats["chunks_per_sec"]
+
+        start = time.perf_counter()
+        engine = VectorSearchEngine(embeddings)
+        result["engine_build_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bm25 = BM25Index(docs)
+        result["bm25_build_seconds"] = time.perf_counter() - start
+
+        # --- 暖啟動：不應該有任何 embedding 呼叫 ---
+        calls = backend.embed_calls
+        start = time.perf_counter()
+        EmbeddingStore(workdir, backend.embed_model).embed_corpus(docs, embedder)
+        result["warm_start_seconds"] = time.perf_counter() - start
+        result["warm_start_embed_calls"] = backend.embed_calls - calls
+
+        result["memory"] = {
+            "engine_mb": engine.matrix.nbytes / 2**20,
+            "bm25_mb": sum(a.nbytes for a in (bm25.offsets, bm25.doc_ids, bm25.tfs, bm25.idf, bm25.norm)) / 2**20,
+            "max_rss_mb": max_rss_mb(),
+        }
+
+        # --- 搜尋延遲 ---
+        q_embs = np.asarray(backend.embed_many(queries), dtype=np.float32)
+        latencies = []
+        for q in q_embs:
+            start = time.perf_counter()
+            engine.search(q, args.k)
+            latencies.append(time.perf_counter() - start)
+        result["search"] = {**percentiles(latencies), "qps": len(latencies) / sum(latencies)}
+
+        start = time.perf_counter()
+        for s in range(0, len(q_embs), 64):
+            engine.search_batch(q_embs[s:s + 64], args.k)
+        result["search"]["batch64_qps"] = len(q_embs) / (time.perf_counter() - start)
+
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            bm25.search(q, args.k)
+            latencies.append(time.perf_counter() - start)
+        result["bm25_search"] = {**percentiles(latencies), "qps": len(latencies) / sum(latencies)}
+
+        # --- IVF recall@k ---
+        if n >= args.ann_min:
+            start = time.perf_counter()
+            index = IVFIndex(nlist=max(1, int(np.sqrt(n)))).build(embeddings)
+            result["ivf"] = {
+                "nlist": index.nlist,
+                "build_seconds": time.perf_counter() - start,
+                "report": recall_report(index, engine, q_embs, top_k=args.k),
+            }
+
+        # --- 壓縮索引：記憶體、磁碟大小與 recall@k ---
+        result["quantization"] = []
+        for mode in args.quantize.split(","):
+            codec_args = {"m": args.pq_m} if mode == "pq" else {}
+            start = time.perf_counter()
+            index = QuantizedSearchEngine(embeddings, mode, rescore_vectors=embeddings, **codec_args)
+            build_seconds = time.perf_counter() - start
+            qdir = os.path.join(workdir, f"quantized-{mode}")
+            index.save(qdir)
+            result["quantization"].append({
+                **quantization_report(index, engine, q_embs, top_k=args.k),
+                "build_seconds": build_seconds,
+                "disk_mb": sum(os.path.getsize(os.path.join(qdir, f)) for f in os.listdir(qdir)) / 2**20,
+            })
+
+        # --- rerank 吞吐量 ---
+        reranker = GeminiReranker(model=backend.generative_model(),
+                                  max_concurrency=args.rerank_concurrency, verbose=False)
+        rerank_queries = queries[:args.rerank_queries]
+        start = time.perf_counter()
+        for q, q_emb in zip(rerank_queries, q_embs):
+            idx, _ = engine.search(q_emb, 5)
+            reranker.score(q, [docs[i] for i in idx])
+        elapsed = time.perf_counter() - start
+        result["rerank"] = {
+            "queries": len(rerank_queries),
+            "candidates_per_sec": 5 * len(rerank_queries) / elapsed,
+            "ms_per_query": elapsed * 1000 / max(len(rerank_queries), 1),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線 RAG 效能測試（FakeBackend）")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="語料大小，以逗號分隔")
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="embedding 併發批次數")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="每次 embedding 請求的模擬延遲（秒）")
+    parser.add_argument("--generate-latency", type=float, default=0.0, help="每次生成請求的模擬延遲（秒）")
+    parser.add_argument("--rerank-queries", type=int, default=50)
+    parser.add_argument("--rerank-concurrency", type=int, default=5)
+    parser.add_argument("--ann-min", type=int, default=10000, help="語料至少這麼大才測 IVF")
+    parser.add_argument("--quantize", default="float16,int8,pq", help="要測的壓縮模式，以逗號分隔")
+    parser.add_argument("--pq-m", type=int, default=16, help="PQ 的分段數（需整除 --dim）")
+    parser.add_argument("--out", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = []
+    for n in (int(s) for s in args.sizes.split(",")):
+        print(f"⏱️ 測試 {n} 段 ...", flush=True)
+        results.append(bench_size(n, args))
+        r = results[-1]
+        print(f"  建立 {r['embed_seconds']:.2f}s，搜尋 p50 {r['search']['p50_ms']:.3f}ms "
+              f"p99 {r['search']['p99_ms']:.3f}ms，{r['search']['qps']:.0f} QPS")
+        for q in r["quantization"]:
+            recalls = "、".join(f"rescore={x['rescore']} recall@{args.k} {x[f'recall@{args.k}']:.3f}"
+                                for x in q["rescore"])
+            print(f"  {q['mode']}：{q['mb']:.2f}MB（{q['compression']:.1f}x），{recalls}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
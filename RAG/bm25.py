@@ -0,0 +1,158 @@
+import re
+import numpy as np
+
+from vector_search import top_k_indices
+from tracing import NULL_TRACE
+
+# === BM25 關鍵字索引 + 混合檢索 ===
+# 斷詞：連續的中日韓字元切成字元 bigram（單一字元則保留 unigram），英數字以單字為單位。
+# 倒排索引以 CSR 方式存成三個連續陣列：offsets / doc_ids(int32) / tfs(uint16)。
+# 混合檢索：BM25 與 embedding 的排名以 Reciprocal Rank Fusion 合併；
+# 若 BM25 結果已經很明確（見 is_decisive），直接回傳，不呼叫 embedding API。
+
+_TOKEN_RE = re.compile(r"[㐀-鿿豈-﫿぀-ヿ가-힯]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[^a-z0-9]")
+
+
+def tokenize(text: str):
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """記憶體內的 BM25 倒排索引"""
+
+    def __init__(self, docs, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(docs)
+        vocab, postings = {}, []
+        doc_len = np.zeros(self.n_docs, dtype=np.float32)
+
+        for doc_id, doc in enumerate(docs):
+            counts = {}
+            for tok in tokenize(doc):
+                counts[tok] = counts.get(tok, 0) + 1
+            doc_len[doc_id] = sum(counts.values())
+            for tok, tf in counts.items():
+                term = vocab.setdefault(tok, len(vocab))
+                if term == len(postings):
+                    postings.append([])
+                postings[term].append((doc_id, tf))
+
+        self.vocab = vocab
+        lengths = np.array([len(p) for p in postings], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        flat = [pair for plist in postings for pair in plist]
+        self.doc_ids = np.array([d for d, _ in flat], dtype=np.int32)
+        self.tfs = np.array([min(tf, 65535) for _, tf in flat], dtype=np.uint16)
+        self.idf = np.log1p((self.n_docs - lengths + 0.5) / (lengths + 0.5)).astype(np.float32)
+        avg = doc_len.mean() if self.n_docs else 1.0
+        # 每篇文件的長度正規化項，查詢時直接查表
+        self.norm = (self.k1 * (1 - self.b + self.b * doc_len / max(avg, 1e-9))).astype(np.float32)
+
+    def __len__(self):
+        return self.n_docs
+
+    def _terms(self, query):
+        return sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+
+    def scores(self, query):
+        """回傳 (所有文件的 BM25 分數, 每篇文件命中的 query term 數)"""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        matched = np.zeros(self.n_docs, dtype=np.int32)
+        for term in self._terms(query):
+            s, e = self.offsets[term], self.offsets[term + 1]
+            docs = self.doc_ids[s:e]
+            tf = self.tfs[s:e].astype(np.float32)
+            # 同一個 term 的 posting 中 doc_id 不重複，可以直接用 fancy index 累加
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+            matched[docs] += 1
+        return scores, matched
+
+    def search(self, query, top_k=5):
+        scores, _ = self.scores(query)
+        idx = top_k_indices(scores, top_k)
+        idx = idx[scores[idx] > 0]
+        return idx, scores[idx]
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """合併多組排名（每組是由好到壞的文件索引），回傳 {文件索引: RRF 分數}"""
+    fused = {}
+    for r, ranking in enumerate(rankings):
+        w = 1.0 if weights is None else weights[r]
+        for rank, doc in enumerate(ranking):
+            fused[int(doc)] = fused.get(int(doc), 0.0) + w / (k + rank + 1)
+    return fused
+
+
+class HybridSearcher:
+    """BM25 + embedding 混合檢索，BM25 夠明確時走純關鍵字快速路徑"""
+
+    def __init__(self, bm25, engine, embed_fn, pool=20, rrf_k=60,
+                 min_coverage=0.8, margin=1.5):
+        self.bm25 = bm25
+        self.engine = engine
+        self.embed_fn = embed_fn
+        self.pool = pool
+        self.rrf_k = rrf_k
+        self.min_coverage = min_coverage
+        self.margin = margin
+        self.lexical_only = 0
+        self.hybrid = 0
+
+    def is_decisive(self, query, scores, matched, top):
+        """
+        第一名涵蓋了大部分 query term，且分數明顯領先（或只有它命中），
+        就視為關鍵字結果已足夠明確。
+        """
+        n_query = len(set(tokenize(query)))
+        if len(top) == 0:
+            return False
+        if matched[top[0]] / n_query < self.min_coverage:
+            return False
+        if len(top) == 1 or scores[top[1]] <= 0:
+            return True
+        return scores[top[0]] >= self.margin * scores[top[1]]
+
+    def lexical(self, query, top_k=5):
+        """BM25 前 pool 名（至少 top_k 名）與其分數，以及是否已足夠明確"""
+        scores, matched = self.bm25.scores(query)
+        lex = top_k_indices(scores, max(self.pool, top_k))
+        lex = lex[scores[lex] > 0]
+        return lex, scores[lex], self.is_decisive(query, scores, matched, lex)
+
+    def fuse(self, lex_idx, emb_idx, top_k=5):
+        """以 RRF 合併 BM25 與 embedding 的排名，回傳 (索引, RRF 分數)"""
+        fused = reciprocal_rank_fusion([lex_idx, emb_idx], k=self.rrf_k)
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return np.array(best, dtype=np.int64), np.array([fused[i] for i in best])
+
+    def search(self, query, top_k=5, trace=NULL_TRACE):
+        """
+        回傳 (索引, 分數, 模式)；模式為 "lexical" 或 "hybrid"，分數依模式為 BM25 或 RRF。
+        有傳入 trace 時記錄 lexical / query_embedding / vector_search / fusion 各階段耗時。
+        """
+        with trace.stage("lexical"):
+            lex, lex_scores, decisive = self.lexical(query, top_k)
+        if decisive:
+            self.lexical_only += 1
+            return lex[:top_k], lex_scores[:top_k], "lexical"
+
+        self.hybrid += 1
+        with trace.stage("query_embedding"):
+            q_emb = self.embed_fn(query)
+        with trace.stage("vector_search"):
+            emb_idx, _ = self.engine.search(q_emb, self.pool)
+        with trace.stage("fusion"):
+            idx, scores = self.fuse(lex, emb_idx, top_k)
+        return idx, scores, "hybrid"
@@ -0,0 +1,113 @@
+import re
+from collections import namedtuple
+
+# === 串流切段（token 預算）===
+# 檔案以 generator 逐行讀取，記憶體用量與檔案大小無關：
+#   1. 以空行切出段落（一組 Q/A 永遠在同一個段落裡）
+#   2. 段落超過 max_tokens 才依行（必要時依字元）切開，相鄰片段重疊 overlap_tokens
+#   3. merge=True 時把連續段落合併到接近 max_tokens，新 chunk 開頭重疊上一個 chunk 的結尾段落
+# 每個 chunk 都帶有原始檔案的 byte 位移 [start, end)，方便回頭對照來源。
+
+Chunk = namedtuple("Chunk", ["text", "source", "start", "end"])
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿぀-ヿ가-힯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓字元各算 1，其餘約每 4 個字元 1 個"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4)
+
+
+def iter_records(path, encoding="utf-8"):
+    """逐行讀檔，yield 每個以空行分隔的段落：[(行內容, start, end), ...]"""
+    with open(path, "rb") as f:
+        lines, offset = [], 0
+        for raw in f:
+            start = offset
+            offset += len(raw)
+            body = raw.rstrip(b"\r\n")
+            line = body.decode(encoding)
+            if line.strip():
+                lines.append((line, start, start + len(body)))
+            elif lines:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+
+def _split_line(line, start, max_tokens, encoding):
+    """單行就超過預算時，依字元硬切"""
+    piece, piece_start = "", start
+    for ch in line:
+        if piece and estimate_tokens(piece + ch) > max_tokens:
+            yield piece, piece_start, piece_start + len(piece.encode(encoding))
+            piece_start += len(piece.encode(encoding))
+            piece = ""
+        piece += ch
+    if piece:
+        yield piece, piece_start, piece_start + len(piece.encode(encoding))
+
+
+def _units(record, max_tokens, overlap_tokens, encoding):
+    """把一個段落變成一或多個不超過預算的片段 (text, start, end, tokens)"""
+    text = "\n".join(line for line, _, _ in record)
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        yield text, record[0][1], record[-1][2], tokens
+        return
+
+    lines = []
+    for line, start, end in record:
+        if estimate_tokens(line) > max_tokens:
+            lines.extend(_split_line(line, start, max_tokens, encoding))
+        else:
+            lines.append((line, start, end))
+
+    window, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line[0]) + 1
+        if window and used + cost > max_tokens:
+            yield "\n".join(l for l, _, _ in window), window[0][1], window[-1][2], used
+            # 保留結尾幾行作為下一個片段的開頭
+            keep, kept = [], 0
+            for prev in reversed(window):
+                c = estimate_tokens(prev[0]) + 1
+                if kept + c > overlap_tokens or kept + c + cost > max_tokens:
+                    break
+                keep.insert(0, prev)
+                kept += c
+            window, used = keep, kept
+        window.append(line)
+        used += cost
+    if window:
+        yield "\n".join(l for l, _, _ in window), window[0][1], window[-1][2], used
+
+
+def iter_chunks(path, max_tokens=256, overlap_tokens=32, merge=True, encoding="utf-8"):
+    """yield Chunk；merge=False 時每個段落（Q/A）各自成一個 chunk"""
+    buf, used = [], 0
+
+    def flush():
+        return Chunk("\n\n".join(u[0] for u in buf).strip(), path, buf[0][1], buf[-1][2])
+
+    for record in iter_records(path, encoding):
+        for unit in _units(record, max_tokens, overlap_tokens, encoding):
+            if not merge:
+                yield Chunk(unit[0].strip(), path, unit[1], unit[2])
+                continue
+            if buf and used + unit[3] > max_tokens:
+                yield flush()
+                keep, kept = [], 0
+                for prev in reversed(buf):
+                    if kept + prev[3] > overlap_tokens or kept + prev[3] + unit[3] > max_tokens:
+                        break
+                    keep.insert(0, prev)
+                    kept += prev[3]
+                buf, used = keep, kept
+            buf.append(unit)
+            used += unit[3]
+    if merge and buf:
+        yield flush()
+
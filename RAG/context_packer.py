@@ -0,0 +1,71 @@
+import numpy as np
+
+from chunker import estimate_tokens
+from vector_search import normalize_rows
+
+# === 組裝 Prompt 用的資料來源 ===
+# 介於檢索與生成之間：
+#   1. 與已選段落 cosine ≥ dedup_threshold 的近似重複段落直接丟掉
+#   2. 其餘依 MMR（相關度 − 與已選段落的最大相似度）挑選，避免內容重複
+#   3. 加入後會超過 token 預算的段落略過，最多選 max_chunks 段
+# 檢索時可以多取幾段當備援（重複的被剔除時遞補），但 prompt 不會因此變長：
+# 省下的 token 以「不打包、直接送前 max_chunks 段」為基準計算。
+
+
+def format_context(chunks):
+    return "\n".join(f"[資料來源{i+1}]\n{c}" for i, c in enumerate(chunks))
+
+
+class ContextPacker:
+    def __init__(self, max_tokens=1500, dedup_threshold=0.95, mmr_lambda=0.7, max_chunks=None):
+        self.max_tokens = max_tokens
+        self.max_chunks = max_chunks
+        self.dedup_threshold = dedup_threshold
+        self.mmr_lambda = mmr_lambda
+        self.tokens_saved = 0
+
+    def pack(self, query_emb, chunks, chunk_embs, max_chunks=None):
+        """
+        chunks 為檢索結果（由高到低），chunk_embs 為對應的向量。
+        query_emb 為 None 時以 chunks 的順序當作相關度（例如走關鍵字快速路徑，或 chunks 已經過 rerank）。
+        回傳 (選中的段落, {"dropped_duplicates", "dropped_budget", "tokens_used", "tokens_saved"})。
+        """
+        max_chunks = min(max_chunks or self.max_chunks or len(chunks), len(chunks))
+        vecs = normalize_rows(chunk_embs)
+        if query_emb is not None:
+            relevance = vecs @ normalize_rows(query_emb)
+        else:
+            relevance = 1.0 - np.arange(len(chunks), dtype=np.float32) / max(len(chunks), 1)
+        costs = [estimate_tokens(f"[資料來源{i+1}]\n{c}") for i, c in enumerate(chunks)]
+
+        selected, used = [], 0
+        stats = {"dropped_duplicates": 0, "dropped_budget": 0}
+        remaining = list(range(len(chunks)))
+        while remaining and len(selected) < max_chunks:
+            if selected:
+                redundancy = (vecs[remaining] @ vecs[selected].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+
+            # 近似重複的段落不可能再被選中，先移除
+            dup = redundancy >= self.dedup_threshold
+            if dup.any():
+                stats["dropped_duplicates"] += int(dup.sum())
+                remaining = [r for r, d in zip(remaining, dup) if not d]
+                redundancy = redundancy[~dup]
+                if not remaining:
+                    break
+
+            mmr = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining.pop(int(np.argmax(mmr)))
+            if used + costs[best] > self.max_tokens:
+                stats["dropped_budget"] += 1
+                continue
+            selected.append(best)
+            used += costs[best]
+
+        baseline = sum(costs[:max_chunks])
+        stats["tokens_used"] = used
+        stats["tokens_saved"] = max(baseline - used, 0)
+        self.tokens_saved += stats["tokens_saved"]
+        return [chunks[i] for i in selected], stats
@@ -0,0 +1,193 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# === 磁碟上的 Embedding 快取 ===
+# 檔案配置（每個 embedding 模型一組，放在同一個資料夾）：
+#   <slug>.f32   → 連續的 float32 向量（count × dim），直接 memory-map 讀取
+#   <slug>.keys  → 每列對應的 sha256 digest（32 bytes），與向量列數一一對應
+#   <slug>.json  → 中繼資料 {model, dim, count}，最後才原子性地覆寫
+# 向量與 key 都是 append-only；count 以 .json 為準，寫到一半中斷的尾巴會被截掉。
+
+KEY_BYTES = 32
+
+
+def content_key(text: str, model: str) -> bytes:
+    """以「模型名稱 + 段落內容」計算 sha256，作為 embedding 的快取 key"""
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+def _slug(model: str) -> str:
+    return model.replace("/", "_").replace(":", "_")
+
+
+class EmbeddingStore:
+    """以 content hash 為 key 的持久化 embedding 儲存，讀取時使用 memory-map"""
+
+    def __init__(self, directory: str, model: str):
+        self.directory = directory
+        self.model = model
+        base = os.path.join(directory, _slug(model))
+        self.vec_path = base + ".f32"
+        self.key_path = base + ".keys"
+        self.meta_path = base + ".json"
+        self.dim = None
+        self.count = 0
+        self._matrix = None
+        self._rows = None
+        self._load_meta()
+
+    # --- 讀取中繼資料 ---
+    def _load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model") != self.model:
+            raise ValueError(f"embedding store 模型不符：{meta.get('model')} != {self.model}")
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self._truncate_tail()
+
+    def _truncate_tail(self):
+        """
+        截掉上次寫入中斷而多出的尾巴，讓檔案長度與 count 一致。
+        檔案比 count 還短（例如 compact 中途中斷）時無法修復，整個快取清空重建。
+        """
+        files = ((self.vec_path, self.dim * 4), (self.key_path, KEY_BYTES))
+        sizes = [os.path.getsize(p) if os.path.exists(p) else 0 for p, _ in files]
+        if any(size < self.count * row for size, (_, row) in zip(sizes, files)):
+            print(f"⚠️ embedding 快取檔案不完整，將重新建立：{self.directory}")
+            self.count = 0
+        for (path, row_bytes), size in zip(files, sizes):
+            expected = self.count * row_bytes
+            if size > expected:
+                with open(path, "r+b") as f:
+                    f.truncate(expected)
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "dim": self.dim, "count": self.count}, f)
+        os.replace(tmp, self.meta_path)
+
+    def __len__(self):
+        return self.count
+
+    # --- memory-mapped 向量矩陣（唯讀）---
+    @property
+    def matrix(self):
+        if self.count == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != self.count:
+            self._matrix = np.memmap(self.vec_path, dtype=np.float32, mode="r",
+                                     shape=(self.count, self.dim))
+        return self._matrix
+
+    def _row_index(self):
+        """key → 列號，第一次查詢時才建立"""
+        if self._rows is None:
+            self._rows = {}
+            if self.count:
+                for row, key in enumerate(self.keys()):
+                    self._rows[key] = row
+        return self._rows
+
+    def lookup(self, keys):
+        """回傳每個 key 對應的列號，找不到為 -1"""
+        rows = self._row_index()
+        return np.array([rows.get(k, -1) for k in keys], dtype=np.int64)
+
+    def keys(self):
+        """依列號排列的所有 key"""
+        if self.count == 0:
+            return []
+        return [k.ljust(KEY_BYTES, b"\0") for k in
+                np.fromfile(self.key_path, dtype=f"S{KEY_BYTES}", count=self.count).tolist()]
+
+    # --- 新增向量（append-only）---
+    def append(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(keys) != vectors.shape[0]:
+            raise ValueError("keys 與 vectors 的數量不一致")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量維度不符：{vectors.shape[1]} != {self.dim}")
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.vec_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.key_path, "ab") as f:
+            f.write(b"".join(keys))
+
+        rows = self._row_index()
+        for i, key in enumerate(keys):
+            rows[key] = self.count + i
+        self.count += len(keys)
+        self._save_meta()
+
+    # --- 壓縮：丟掉不再使用的列 ---
+    def compact(self, keep_keys):
+        """
+        只保留 keep_keys 中已存在的向量，並依 keep_keys 的順序重寫檔案，
+        之後同樣順序的語料可以直接拿到 memmap 切片。回傳刪除的列數。
+        """
+        rows = self.lookup(keep_keys)
+        seen, order, kept_keys = set(), [], []
+        for key, row in zip(keep_keys, rows):
+            if row >= 0 and key not in seen:
+                seen.add(key)
+                order.append(row)
+                kept_keys.append(key)
+        removed = self.count - len(order)
+        if removed == 0 and order == list(range(self.count)):
+            return 0
+
+        vectors = np.asarray(self.matrix[np.array(order, dtype=np.int64)]) if order else \
+            np.empty((0, self.dim or 0), dtype=np.float32)
+        self._matrix = None
+        for path, data in ((self.vec_path, vectors.tobytes()), (self.key_path, b"".join(kept_keys))):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        self.count = len(order)
+        self._rows = {key: row for row, key in enumerate(kept_keys)}
+        self._save_meta()
+        return removed
+
+    # --- 取得整份語料的 embedding ---
+    def embed_corpus(self, texts, embedder):
+        """
+        回傳與 texts 對齊的 (N, dim) 矩陣。
+        已快取的段落直接從 memory-map 讀取，只有缺少的段落才交給 embedder。
+        embedder 可以是 BatchEmbedder（每完成一批就寫入，失敗重跑時不會重算）
+        或單純的 embed_many(list[str]) 函式。
+        若所有段落剛好依序對應到前 N 列，直接回傳 memmap 切片，不做任何複製。
+        """
+        keys = [content_key(t, self.model) for t in texts]
+        rows = self.lookup(keys)
+
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            # 同一批內重複的段落只算一次
+            todo = {}
+            for i in missing:
+                todo.setdefault(keys[i], texts[i])
+            new_keys = list(todo)
+            new_texts = [todo[k] for k in new_keys]
+            if hasattr(embedder, "embed"):
+                embedder.embed(new_texts, on_batch=lambda start, vectors: self.append(
+                    new_keys[start:start + len(vectors)], vectors))
+            else:
+                self.append(new_keys, embedder(new_texts))
+            rows = self.lookup(keys)
+
+        if len(rows) and np.array_equal(rows, np.arange(len(rows))):
+            return self.matrix[:len(rows)]
+        return np.asarray(self.matrix[rows])
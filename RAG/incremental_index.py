@@ -0,0 +1,75 @@
+import os
+import threading
+
+from embedding_store import content_key
+from chunker import iter_chunks
+
+# === 增量索引 ===
+# 以 content hash 比對目前的段落與 EmbeddingStore 中已有的向量：
+#   新增 / 修改過的段落 → 只 embed 這些
+#   已刪除的段落       → 累積超過 compact_ratio 時才重寫檔案，把它們丟掉
+# watch() 會在背景輪詢檔案的 mtime / 大小，一有變動就同步並通知呼叫端。
+
+
+def load_faq(path, max_tokens=512, overlap_tokens=64):
+    """讀入以空行分隔的 FAQ 段落（每組 Q/A 一段，過長的才依 token 預算切開）"""
+    return [c.text for c in iter_chunks(path, max_tokens, overlap_tokens, merge=False)]
+
+
+class IncrementalIndexer:
+    def __init__(self, store, embedder, load_docs, compact_ratio=0.25):
+        self.store = store
+        self.embedder = embedder
+        self.load_docs = load_docs
+        self.compact_ratio = compact_ratio
+        self._stop = threading.Event()
+
+    def sync(self):
+        """回傳 (docs, embeddings, diff)；diff 記錄新增、刪除、未變動的段落數"""
+        docs = self.load_docs()
+        keys = [content_key(d, self.store.model) for d in docs]
+        live, stored = set(keys), set(self.store.keys())
+        diff = {
+            "added": len(live - stored),
+            "removed": len(stored - live),
+            "unchanged": len(live & stored),
+            "compacted": 0,
+        }
+
+        embeddings = self.store.embed_corpus(docs, self.embedder)
+
+        # 失效的列太多才壓縮；列順序同時排成與目前語料相同，之後讀取不必複製
+        if stored and diff["removed"] / len(stored) > self.compact_ratio:
+            diff["compacted"] = self.store.compact(keys)
+            embeddings = self.store.embed_corpus(docs, self.embedder)
+        return docs, embeddings, diff
+
+    # --- watch 模式 ---
+    def watch(self, path, on_update, interval=2.0):
+        """
+        背景執行緒：path 的 mtime 或大小改變時呼叫 sync()，
+        再以 on_update(docs, embeddings, diff) 通知呼叫端替換索引。
+        """
+        def signature():
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+
+        def loop():
+            last = signature()
+            while not self._stop.wait(interval):
+                try:
+                    current = signature()
+                    if current == last:
+                        continue
+                    on_update(*self.sync())
+                    last = current
+                except Exception as e:
+                    # 編輯器存檔途中可能讀到一半的檔案，下一輪再試
+                    print(f"⚠️ [Watch] 重新索引失敗：{e}")
+
+        thread = threading.Thread(target=loop, name="faq-watch", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
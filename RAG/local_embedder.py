@@ -0,0 +1,142 @@
+import hashlib
+import unicodedata
+import numpy as np
+
+from vector_search import VectorSearchEngine, normalize_rows
+
+# === 本機 CPU embedding（不需網路、不需額外套件）===
+# 任何有 embed_model 屬性與 embed_many(list[str]) 方法的物件都可以當 embedder
+# （GeminiBackend / FakeBackend / LocalEmbedder 皆同），可交給 BatchEmbedder、EmbeddingStore 使用。
+#
+# LocalEmbedder：字元 n-gram → 雜湊到 n_features 個桶 → TF-IDF 加權 → 稀疏隨機投影到 dim 維。
+#   - n-gram 雜湊以 numpy 向量化計算（Unicode code point 的多項式雜湊）
+#   - 每個桶固定投影到 nnz 個維度、正負號隨機（Achlioptas 式稀疏投影），不需存投影矩陣
+#   - fit(docs) 統計 document frequency；未 fit 時所有 n-gram 權重相同
+#
+# rag_simple_gemini.py 在 Gemini embedding 被限流或離線時改用它檢索；fit 後的 IDF 以 save / load 保存。
+
+_MASK = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix(h):
+    """splitmix64 finalizer：讓雜湊值的每個 bit 都均勻分佈"""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+class LocalEmbedder:
+    def __init__(self, dim=256, ngram_range=(1, 3), n_features=2**20, nnz=4, seed=0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.n_features = n_features
+        self.nnz = nnz
+        self.seed = seed
+        self.df = None
+        self.n_docs = 0
+        self._idf = None
+
+    @property
+    def embed_model(self):
+        """參數或 IDF 不同，向量就不同；名稱要跟著變，EmbeddingStore 才不會混用"""
+        lo, hi = self.ngram_range
+        name = f"local-char{lo}{hi}-d{self.dim}-f{self.n_features}-s{self.seed}"
+        if self.df is not None:
+            name += "-" + hashlib.sha256(self.df.tobytes()).hexdigest()[:8]
+        return name
+
+    def _features(self, text):
+        """回傳 (桶編號, 出現次數)"""
+        codes = np.frombuffer(normalize_text(text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        hashes = []
+        with np.errstate(over="ignore"):
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                if len(codes) < n:
+                    break
+                h = np.full(len(codes) - n + 1, np.uint64(n * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF))
+                for j in range(n):
+                    h = h * np.uint64(1_000_003) + codes[j:len(codes) - n + 1 + j]
+                hashes.append(_mix(h ^ np.uint64(self.seed)))
+        if not hashes:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        buckets = (np.concatenate(hashes) % np.uint64(self.n_features)).astype(np.int64)
+        return np.unique(buckets, return_counts=True)
+
+    def fit(self, docs):
+        """統計每個桶的 document frequency，之後以 IDF 加權"""
+        df = np.zeros(self.n_features, dtype=np.int32)
+        for doc in docs:
+            df[self._features(doc)[0]] += 1
+        self.df = df
+        self.n_docs = len(docs)
+        self._idf = (np.log((1 + self.n_docs) / (1 + df)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, text):
+        buckets, counts = self._features(text)
+        weights = (1 + np.log(counts)).astype(np.float32)
+        if self._idf is not None:
+            weights *= self._idf[buckets]
+        # 每個桶投影到 nnz 個維度，維度與正負號由桶編號決定
+        with np.errstate(over="ignore"):
+            h = _mix(buckets.astype(np.uint64)[:, None] * np.uint64(self.nnz)
+                     + np.arange(self.nnz, dtype=np.uint64) + np.uint64(self.seed << 32))
+        dims = (h % np.uint64(self.dim)).astype(np.int64).ravel()
+        signs = np.where((h >> np.uint64(63)) == 1, -1.0, 1.0).ravel()
+        vec = np.bincount(dims, weights=signs * np.repeat(weights, self.nnz), minlength=self.dim)
+        return normalize_rows(vec)
+
+    def embed_many(self, texts):
+        return np.stack([self.embed(t) for t in texts]) if len(texts) else np.empty((0, self.dim), np.float32)
+
+    def save(self, path):
+        np.savez(path, df=self.df if self.df is not None else np.empty(0, np.int32), n_docs=self.n_docs,
+                 config=np.array([self.dim, *self.ngram_range, self.n_features, self.nnz, self.seed]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, lo, hi, n_features, nnz, seed = (int(x) for x in data["config"])
+        embedder = cls(dim, (lo, hi), n_features, nnz, seed)
+        if len(data["df"]):
+            embedder.df = data["df"]
+            embedder.n_docs = int(data["n_docs"])
+            embedder._idf = (np.log((1 + embedder.n_docs) / (1 + embedder.df)) + 1).astype(np.float32)
+        return embedder
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    from backends import FakeBackend
+    from benchmark import synthetic_corpus, synthetic_queries
+
+    parser = argparse.ArgumentParser(description="本機 embedding（離線備援）相對 Gemini 向量的 recall 與速度")
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = synthetic_corpus(args.n)
+    queries = synthetic_queries(docs, args.queries)
+    backend = FakeBackend()  # 代替 Gemini embedding
+    exact = VectorSearchEngine(np.asarray(backend.embed_many(docs)))
+
+    start = time.perf_counter()
+    local = LocalEmbedder().fit(docs)
+    local_engine = VectorSearchEngine(local.embed_many(docs))
+    print(f"🏗️ 本機 embedding：{time.perf_counter() - start:.2f}s（{args.n} 段，{local.embed_model}）")
+
+    hits, elapsed = 0, 0.0
+    for q in queries:
+        truth, _ = exact.search(backend.embed_many([q])[0], args.k)
+        start = time.perf_counter()
+        found, _ = local_engine.search(local.embed(q), args.k)
+        elapsed += time.perf_counter() - start
+        hits += len(set(found.tolist()) & set(truth.tolist()))
+    print(f"  recall@{args.k}（相對全量 Gemini 向量）：{hits / (args.queries * args.k):.3f}，"
+          f"{elapsed * 1000 / args.queries:.2f} ms/query")
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import numpy as np
+
+from vector_search import normalize_rows, top_k_indices
+from ann_index import kmeans
+
+# === 壓縮的 Embedding 儲存 ===
+# 三種模式（以 768 維 float32 = 3072 bytes/向量為基準）：
+#   float16 → 1536 bytes（2x）
+#   int8    → 768 + 4 bytes（每個向量一個 scale，約 4x）
+#   pq      → m bytes（乘積量化，m=96 時約 32x）
+# 搜尋直接在壓縮碼上計算分數；可選擇用原始向量對候選名單做精確重算。
+# QuantizedSearchEngine 可存成 .npy（save / load，讀取時 memory-map），
+# rag_simple_gemini.py / rag_service.py 以 --quantize 啟用；benchmark.py 會輸出各模式的記憶體與 recall@k。
+
+BLOCK_ROWS = 65536  # 解碼時一次處理的列數，避免暫存陣列跟語料一樣大
+
+
+class Float16Codec:
+    name = "float16"
+
+    def fit(self, data):
+        return self
+
+    def encode(self, data):
+        codes = np.empty(data.shape, dtype=np.float16)
+        for s in range(0, len(data), BLOCK_ROWS):
+            codes[s:s + BLOCK_ROWS] = normalize_rows(data[s:s + BLOCK_ROWS])
+        return codes
+
+    def scores(self, codes, query):
+        q = normalize_rows(query)
+        out = np.empty(len(codes), dtype=np.float32)
+        for s in range(0, len(codes), BLOCK_ROWS):
+            out[s:s + BLOCK_ROWS] = codes[s:s + BLOCK_ROWS].astype(np.float32) @ q
+        return out
+
+
+class Int8Codec:
+    """純量量化：每個向量各自的 scale = max|x| / 127"""
+    name = "int8"
+
+    def fit(self, data):
+        return self
+
+    def encode(self, data):
+        codes = np.empty(data.shape, dtype=np.int8)
+        scale = np.empty(len(data), dtype=np.float32)
+        for s in range(0, len(data), BLOCK_ROWS):
+            block = normalize_rows(data[s:s + BLOCK_ROWS])
+            block_scale = np.abs(block).max(axis=1) / 127.0
+            block_scale[block_scale == 0] = 1.0
+            codes[s:s + BLOCK_ROWS] = np.round(block / block_scale[:, None])
+            scale[s:s + BLOCK_ROWS] = block_scale
+        return {"codes": codes, "scale": scale}
+
+    def scores(self, codes, query):
+        q = normalize_rows(query)
+        values, scale = codes["codes"], codes["scale"]
+        out = np.empty(len(values), dtype=np.float32)
+        for s in range(0, len(values), BLOCK_ROWS):
+            out[s:s + BLOCK_ROWS] = values[s:s + BLOCK_ROWS].astype(np.float32) @ q
+        return out * scale
+
+
+class PQCodec:
+    """乘積量化：向量切成 m 段，每段用 256 個中心點編碼成 1 byte；查詢用 ADC 查表"""
+    name = "pq"
+
+    def __init__(self, m=96, ksub=256, iters=20, seed=0):
+        self.m = m
+        self.ksub = ksub
+        self.iters = iters
+        self.seed = seed
+        self.codebooks = None  # (m, ksub, dsub)
+
+    def _split(self, data):
+        n, d = data.shape
+        if d % self.m:
+            raise ValueError(f"維度 {d} 無法平均切成 {self.m} 段")
+        return data.reshape(n, self.m, d // self.m)
+
+    def fit(self, data, sample=65536):
+        sub = self._split(normalize_rows(data))
+        self.codebooks = np.stack([
+            kmeans(sub[:, j], self.ksub, iters=self.iters, seed=self.seed + j, sample=sample)
+            for j in range(self.m)
+        ])
+        return self
+
+    def encode(self, data):
+        sub = self._split(normalize_rows(data))
+        codes = np.empty((len(sub), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            book = self.codebooks[j]
+            for s in range(0, len(sub), BLOCK_ROWS):
+                x = sub[s:s + BLOCK_ROWS, j]
+                dist = (book ** 2).sum(axis=1) - 2 * x @ book.T
+                codes[s:s + BLOCK_ROWS, j] = dist.argmin(axis=1)
+        return codes
+
+    def scores(self, codes, query):
+        # ADC：query 不量化，先算每段與 256 個中心點的內積表，再依碼查表加總
+        q = self._split(normalize_rows(query)[None])[0]
+        table = np.einsum("mkd,md->mk", self.codebooks, q)
+        out = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.m):
+            out += table[j][codes[:, j]]
+        return out
+
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+
+
+class QuantizedSearchEngine:
+    """在壓縮碼上做 cosine 搜尋；rescore_vectors 給原始向量時，對候選名單做精確重算"""
+
+    def __init__(self, embeddings, mode="int8", rescore_vectors=None, **codec_args):
+        self.codec = CODECS[mode](**codec_args).fit(embeddings)
+        self.codes = self.codec.encode(embeddings)
+        self.rescore_vectors = rescore_vectors
+
+    def __len__(self):
+        codes = self.codes["codes"] if isinstance(self.codes, dict) else self.codes
+        return len(codes)
+
+    @property
+    def nbytes(self):
+        """壓縮碼實際佔用的記憶體（不含 rescore 用的原始向量）"""
+        if isinstance(self.codes, dict):
+            return sum(v.nbytes for v in self.codes.values())
+        return self.codes.nbytes
+
+    def search(self, query, top_k=5, rescore=4):
+        """
+        回傳 (索引, 分數)，由高到低排序。
+        有 rescore_vectors 時先取 top_k × rescore 個候選，再用原始向量算精確分數。
+        """
+        sims = self.codec.scores(self.codes, query)
+        if self.rescore_vectors is None or not rescore:
+            idx = top_k_indices(sims, top_k)
+            return idx, sims[idx]
+
+        # 依列號排序後再讀原始向量，對 memmap 是循序存取
+        shortlist = np.sort(top_k_indices(sims, top_k * rescore))
+        exact = normalize_rows(self.rescore_vectors[shortlist]) @ normalize_rows(query)
+        best = top_k_indices(exact, top_k)
+        return shortlist[best], exact[best]
+
+    # --- 存檔 / 讀檔 ---
+    def save(self, directory):
+        """壓縮碼（PQ 另外加上 codebooks）每個陣列存成一個 .npy；原始向量不存"""
+        os.makedirs(directory, exist_ok=True)
+        arrays = dict(self.codes) if isinstance(self.codes, dict) else {"codes": self.codes}
+        meta = {"mode": self.codec.name, "arrays": sorted(arrays)}
+        if isinstance(self.codec, PQCodec):
+            np.save(os.path.join(directory, "codebooks.npy"), self.codec.codebooks)
+            meta.update(m=self.codec.m, ksub=self.codec.ksub)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "quantized.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, directory, rescore_vectors=None, mmap=True):
+        with open(os.path.join(directory, "quantized.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        engine = cls.__new__(cls)
+        if meta["mode"] == "pq":
+            engine.codec = PQCodec(m=meta["m"], ksub=meta["ksub"])
+            engine.codec.codebooks = np.load(os.path.join(directory, "codebooks.npy"))
+        else:
+            engine.codec = CODECS[meta["mode"]]()
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in meta["arrays"]}
+        engine.codes = arrays if meta["mode"] == "int8" else arrays["codes"]
+        engine.rescore_vectors = rescore_vectors
+        return engine
+
+
+# === 記憶體與 Recall@k 報表 ===
+def quantization_report(index, engine, queries, top_k=5, rescores=(0, 4)):
+    """
+    以 VectorSearchEngine 的精確結果為基準，量測壓縮索引在不同 rescore 倍數下的 recall@k 與平均延遲
+    （rescore=0 表示只用壓縮碼的分數）。精確分數不低於第 k 名的結果都算命中（同分的文件不會被算錯）。
+    回傳 dict，方便輸出成 JSON。
+    """
+    queries = np.atleast_2d(queries)
+    _, exact = engine.search_batch(queries, top_k)
+    kth = exact[:, -1] - 1e-6
+    report = {
+        "mode": index.codec.name,
+        "mb": index.nbytes / 2**20,
+        "compression": engine.matrix.nbytes / index.nbytes,
+        "rescore": [],
+    }
+    for rescore in rescores:
+        if rescore and index.rescore_vectors is None:
+            continue
+        hits = 0
+        start = time.perf_counter()
+        for q, threshold in zip(queries, kth):
+            found, _ = index.search(q, top_k, rescore=rescore)
+            hits += int(np.sum(engine.scores(q)[found] >= threshold))
+        elapsed = time.perf_counter() - start
+        report["rescore"].append({
+            "rescore": rescore,
+            f"recall@{top_k}": hits / (len(queries) * top_k),
+            "ms_per_query": elapsed * 1000 / len(queries),
+        })
+    return report
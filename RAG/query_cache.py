@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from rerank_cache import normalize_query
+from vector_search import normalize_rows
+
+# === 兩層查詢快取 ===
+# 第一層：問題文字（正規化後）完全相同 → 直接取用上次的 query embedding（LRU）
+# 第二層：語意快取 → 新問題的 embedding 與某個舊問題的 cosine ≥ threshold，
+#         而且這次檢索到的段落集合和當時相同，就直接回傳當時的最終答案，不再呼叫 LLM。
+#         走 BM25 快速路徑（沒有 embedding）的問題改以「正規化後的問題文字 + 段落集合」完全比對。
+
+
+def chunk_set_key(chunks):
+    """檢索結果的指紋：段落內容（不分順序）相同才算同一組"""
+    h = hashlib.sha256()
+    for digest in sorted(hashlib.sha256(c.encode("utf-8")).digest() for c in chunks):
+        h.update(digest)
+    return h.hexdigest()
+
+
+class QueryEmbeddingCache:
+    """以正規化後的問題文字為 key 的 LRU embedding 快取"""
+
+    def __init__(self, embed_fn, maxsize=10_000):
+        self.embed_fn = embed_fn
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        """只查快取、不呼叫 embed_fn；沒有時回傳 None"""
+        with self._lock:
+            return self._items.get(normalize_query(query))
+
+    def __call__(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        emb = np.asarray(self.embed_fn(query), dtype=np.float32)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = emb
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return emb
+
+
+class SemanticAnswerCache:
+    """
+    相似問題 + 相同檢索段落 → 重用最終答案；滿了之後以環狀方式覆蓋最舊的。
+    query_emb 為 None 時以 query 文字完全比對（LRU，最多 max_entries 筆）。
+    """
+
+    def __init__(self, threshold=0.95, max_entries=5_000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None  # (max_entries, d) 正規化後的問題向量，第一次 store 時配置
+        self._entries = [None] * max_entries  # [(chunk_key, answer)]
+        self._size = 0
+        self._next = 0
+        self._exact = OrderedDict()  # (正規化問題, chunk_key) → answer
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size + len(self._exact)
+
+    def lookup(self, query_emb, chunks, query=None):
+        """找到符合條件的舊答案就回傳，否則回傳 None"""
+        key = chunk_set_key(chunks)
+        if query_emb is None:
+            return self._lookup_exact(query, key)
+        with self._lock:
+            if self._size:
+                sims = self._vectors[:self._size] @ normalize_rows(query_emb)
+                # 由最相似的開始找，第一個檢索段落也相同的就用
+                close = np.flatnonzero(sims >= self.threshold)
+                for i in close[np.argsort(-sims[close])]:
+                    if self._entries[i][0] == key:
+                        self.hits += 1
+                        return self._entries[i][1]
+            self.misses += 1
+        return None
+
+    def _lookup_exact(self, query, key):
+        exact_key = (normalize_query(query or ""), key)
+        with self._lock:
+            answer = self._exact.get(exact_key)
+            if answer is not None:
+                self._exact.move_to_end(exact_key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return answer
+
+    def store(self, query_emb, chunks, answer, query=None):
+        if query_emb is None:
+            with self._lock:
+                self._exact[(normalize_query(query or ""), chunk_set_key(chunks))] = answer
+                while len(self._exact) > self.max_entries:
+                    self._exact.popitem(last=False)
+            return
+        row = normalize_rows(query_emb)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(row)), dtype=np.float32)
+            self._vectors[self._next] = row
+            self._entries[self._next] = (chunk_set_key(chunks), answer)
+            self._next = (self._next + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,307 @@
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from batch_embed import BatchEmbedder
+from incremental_index import IncrementalIndexer, load_faq
+from vector_search import VectorSearchEngine
+from quantization import QuantizedSearchEngine
+from bm25 import BM25Index, HybridSearcher
+from query_cache import SemanticAnswerCache
+from context_packer import ContextPacker, format_context
+
+# === 常駐 RAG 服務（asyncio）===
+# 索引只在啟動時載入一次，之後同時服務多個問題：
+#   - 各個問題的 query embedding 在 batch_window 秒內湊成一批，一次送出
+#   - embedding / 生成各有一個 token bucket，超過上游速率限制時請求在這裡排隊
+#   - 同時處理中的問題超過 max_pending 時，新問題等待空位（等太久就回報忙碌）
+# 模型後端可替換（見 backends.py），可用 FakeBackend 在本機壓力測試。
+
+ANSWER_PROMPT = """
+你是一個客服助理，必須根據我提供的 FAQ 內容回答問題。
+這些 FAQ 是系統已經從知識庫中查出的最相似資料來源。
+請務必根據它們回答問題，即使內容部份相關，也要根據現有資料進行合理推斷。
+不要說「找不到」或「未提及」。
+
+回答時請用繁體中文。
+
+=== 已檢索 FAQ 內容 ===
+{context}
+
+=== 使用者問題 ===
+{question}
+"""
+
+
+class ServiceOverloaded(RuntimeError):
+    """等待處理空位超過 queue_timeout"""
+
+
+class RateLimiter:
+    """token bucket：平均每秒 rate 個請求，最多累積 burst 個"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.throttled = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self.throttled += 1
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class MicroBatcher:
+    """把短時間內的多個單筆請求合併成一次 fn(list) 呼叫（在執行緒中執行）"""
+
+    def __init__(self, fn, max_batch=64, max_wait=0.01, limiter=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.limiter = limiter
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()  # 執行中的批次（保留參照，避免 task 在完成前被回收）
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            results = await asyncio.to_thread(self.fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class RAGService:
+    def __init__(self, docs, embeddings, backend, top_k=4, context_chunks=2, max_pending=256, queue_timeout=30.0,
+                 embed_rps=20.0, generate_rps=10.0, max_generate_concurrency=8,
+                 batch_window=0.01, max_batch=64, quantize=None):
+        self.docs = docs
+        self.embeddings = embeddings
+        self.doc_pos = {d: i for i, d in enumerate(docs)}
+        self.backend = backend
+        self.top_k = top_k
+        self.queue_timeout = queue_timeout
+
+        # quantize = "float16" / "int8" / "pq" 時在壓縮碼上搜尋，前幾名再用原始向量精確重算
+        self.engine = (QuantizedSearchEngine(embeddings, quantize, rescore_vectors=embeddings) if quantize
+                       else VectorSearchEngine(embeddings))
+        self.searcher = HybridSearcher(BM25Index(docs), self.engine, embed_fn=None)
+        # 檢索 top_k 段當備援，prompt 最多放 context_chunks 段
+        self.packer = ContextPacker(max_chunks=context_chunks)
+        self.answer_cache = SemanticAnswerCache(threshold=0.95)
+
+        self.embed_batcher = MicroBatcher(backend.embed_many, max_batch, batch_window,
+                                          RateLimiter(embed_rps))
+        self.generate_limiter = RateLimiter(generate_rps)
+        self._generate_slots = asyncio.Semaphore(max_generate_concurrency)
+        self._slots = asyncio.Semaphore(max_pending)
+        self.answered = 0
+
+    # --- 檢索 ---
+    async def retrieve(self, question):
+        """回傳 (段落, query embedding 或 None)"""
+        lex_idx, _, decisive = self.searcher.lexical(question, self.top_k)
+        if decisive:
+            return [self.docs[i] for i in lex_idx[:self.top_k]], None
+        q_emb = np.asarray(await self.embed_batcher.submit(question), dtype=np.float32)
+        emb_idx, _ = self.engine.search(q_emb, self.searcher.pool)
+        best_idx, _ = self.searcher.fuse(lex_idx, emb_idx, self.top_k)
+        return [self.docs[i] for i in best_idx], q_emb
+
+    async def _generate(self, prompt):
+        async with self._generate_slots:
+            await self.generate_limiter.acquire()
+            return await asyncio.to_thread(self.backend.generate, prompt)
+
+    # --- 回答 ---
+    async def ask(self, question):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise ServiceOverloaded("服務忙碌中，請稍後再試") from None
+        try:
+            start = time.perf_counter()
+            # 語意快取以「檢索結果」為 key（查詢與寫入都用打包前的段落，否則打包刪掉段落後永遠不會命中）；
+            # BM25 快速路徑沒有 embedding，以問題文字完全比對
+            retrieved, q_emb = await self.retrieve(question)
+            chunk_embs = self.embeddings[[self.doc_pos[c] for c in retrieved]]
+            chunks, _ = self.packer.pack(q_emb, retrieved, chunk_embs)
+            cached = self.answer_cache.lookup(q_emb, retrieved, query=question)
+            if cached is not None:
+                answer = cached
+            else:
+                prompt = ANSWER_PROMPT.format(context=format_context(chunks), question=question)
+                answer = await self._generate(prompt)
+                self.answer_cache.store(q_emb, retrieved, answer, query=question)
+            self.answered += 1
+            return {"answer": answer, "sources": chunks, "cached": cached is not None,
+                    "seconds": time.perf_counter() - start}
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "answered": self.answered,
+            "embed_batches": self.embed_batcher.batches,
+            "embedded_queries": self.embed_batcher.items,
+            "embed_throttled": self.embed_batcher.limiter.throttled,
+            "generate_throttled": self.generate_limiter.throttled,
+            "answer_cache_hit_rate": self.answer_cache.hit_rate,
+        }
+
+
+def load_service(faq_path, backend, cache_dir=".embedding_cache", **service_args):
+    """載入（或增量更新）索引後建立服務"""
+    store = EmbeddingStore(cache_dir, backend.embed_model)
+    embedder = BatchEmbedder(backend.embed_many, verbose=False)
+    docs, embeddings, _ = IncrementalIndexer(store, embedder, lambda: load_faq(faq_path)).sync()
+    return RAGService(docs, embeddings, backend, **service_args)
+
+
+# === TCP 服務：每行一個 JSON {"id": ..., "question": ...}，回覆一行 JSON ===
+async def serve(service, host="127.0.0.1", port=8765):
+    async def handle(reader, writer):
+        write_lock = asyncio.Lock()
+
+        async def answer(line):
+            try:
+                req = json.loads(line)
+            except json.JSONDecodeError:
+                req = {"question": line}
+            if not isinstance(req, dict) or not isinstance(req.get("question"), str):
+                reply = {"error": "請求必須是 JSON 物件，並包含字串欄位 question"}
+                req = req if isinstance(req, dict) else {}
+            else:
+                try:
+                    reply = await service.ask(req["question"])
+                except Exception as e:
+                    reply = {"error": str(e)}
+            reply["id"] = req.get("id")
+            async with write_lock:
+                writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        tasks = set()
+        # 讀到 EOF（readline 回傳 b""）才結束；空行直接略過
+        while raw := await reader.readline():
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            task = asyncio.create_task(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"🚀 RAG 服務啟動：{host}:{port}（{len(service.docs)} 段 FAQ）")
+    async with server:
+        await server.serve_forever()
+
+
+# === 本機壓力測試 ===
+async def load_test(service, questions, concurrency=50):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(q):
+        async with sem:
+            latencies.append((await service.ask(q))["seconds"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in questions))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {
+        "questions": len(questions),
+        "qps": len(questions) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        **service.stats(),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="常駐 RAG 問答服務")
+    parser.add_argument("--faq", default="faq.txt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fake", action="store_true", help="使用本機 FakeBackend（不呼叫 API）")
+    parser.add_argument("--latency", type=float, default=0.05, help="FakeBackend 每次請求的延遲（秒）")
+    parser.add_argument("--load-test", type=int, default=0, metavar="N", help="送出 N 個問題後印出統計並結束")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--embed-rps", type=float, default=20.0, help="embedding 請求的速率上限")
+    parser.add_argument("--generate-rps", type=float, default=10.0, help="生成請求的速率上限")
+    parser.add_argument("--quantize", choices=["float16", "int8", "pq"], help="向量搜尋改用壓縮碼")
+    args = parser.parse_args()
+
+    if args.fake:
+        from backends import FakeBackend
+        backend = FakeBackend(embed_latency=args.latency, generate_latency=args.latency * 4)
+    else:
+        import os
+        from dotenv import load_dotenv
+        import google.generativeai as genai
+        from backends import GeminiBackend
+
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        backend = GeminiBackend()
+
+    service = load_service(args.faq, backend, embed_rps=args.embed_rps, generate_rps=args.generate_rps,
+                           quantize=args.quantize)
+    if args.load_test:
+        rng = np.random.default_rng(0)
+        # 從 FAQ 問句隨機抽題並加上變化，模擬重複度高的真實流量
+        questions = [service.docs[i].split("\n")[0].removeprefix("Q:").strip() + "?" * int(j % 3)
+                     for j, i in enumerate(rng.integers(0, len(service.docs), args.load_test))]
+        print(json.dumps(await load_test(service, questions, args.concurrency), ensure_ascii=False, indent=2))
+    else:
+        await serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,66 +1,208 @@
 import os
+import sys
+import json
+import threading
 import numpy as np
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+from embedding_store import EmbeddingStore
+from batch_embed import BatchEmbedder, gemini_embed_many
+from vector_search import VectorSearchEngine
+from quantization import QuantizedSearchEngine
+from local_embedder import LocalEmbedder
+from query_cache import QueryEmbeddingCache, SemanticAnswerCache
+from bm25 import BM25Index, HybridSearcher
+from streaming import stream_generate
+from incremental_index import IncrementalIndexer, load_faq
+from context_packer import ContextPacker, format_context
+from chunker import estimate_tokens
+from tracing import Trace, Metrics, log_level
+
 # === 初始化 ===
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# === 讀入 FAQ 文件 ===
-docs = []
-with open("faq.txt", "r", encoding="utf-8") as f:
-    chunks = f.read().strip().split("\n\n")
-    for chunk in chunks:
-        docs.append(chunk.strip())
+# === 除錯輸出與追蹤 ===
+# 預設只印摘要；加上 --debug 印出各階段候選，--quiet 全部關閉
+# 設定 RAG_TRACE_FILE 時，每個問題的階段耗時與計數會寫成一行 JSON
+LOG_LEVEL = log_level(sys.argv)
+metrics = Metrics(path=os.getenv("RAG_TRACE_FILE"))
 
 # === 文字轉向量 ===
+EMBED_MODEL = "models/text-embedding-004"
+
 def embed_text(text: str):
     """使用 Gemini 的 embedding 模型將文字轉換為向量"""
-    res = genai.embed_content(model="models/text-embedding-004", content=text)
+    res = genai.embed_content(model=EMBED_MODEL, content=text)
     return np.array(res["embedding"])
 
-embeddings = [embed_text(doc) for doc in docs]
-
-# === 相似度搜尋 (含 debug) ===
-def search_similar(query, top_k=2):
-    """以 cosine similarity 搜尋最相關的 FAQ 段落（含 debug 輸出）"""
-    print("\n🔍 [DEBUG] 問題內容：", query)
-
-    # 1️⃣ 取得 query 的 embedding
-    q_emb = embed_text(query)
-
-    # 2️⃣ 計算每個段落的 cosine similarity
-    sims = []
-    for idx, d_emb in enumerate(embeddings):
-        sim = np.dot(q_emb, d_emb) / (np.linalg.norm(q_emb) * np.linalg.norm(d_emb))
-        sims.append(sim)
-
-    # 3️⃣ 排序後取前 k 名
-    sorted_idx = np.argsort(sims)[::-1]
-
-    print("\n📊 [DEBUG] 各 FAQ 相似度分數：")
-    for i in sorted_idx:
-        print(f"  ({i}) {sims[i]:.3f} → {docs[i][:60]}")
-
-    # 4️⃣ 取前 k 名的索引
-    best_idx = sorted_idx[:top_k]
-
-    print("\n🏆 [DEBUG] 選中前 {} 名：".format(top_k))
-    for rank, i in enumerate(best_idx, 1):
-        print(f"  TOP {rank}: {sims[i]:.3f} → {docs[i][:60]}")
+# === 查詢快取 ===
+# 同一個問題不重算 embedding；相似問題且檢索到相同段落時，直接重用上次的答案
+embed_query = QueryEmbeddingCache(embed_text)
+answer_cache = SemanticAnswerCache(threshold=0.95)
+
+# === Prompt 資料來源組裝 ===
+# 檢索 4 段，prompt 最多放 2 段（與加入打包前相同）；多的 2 段只在有重複段落被剔除時遞補
+packer = ContextPacker(max_tokens=1500, dedup_threshold=0.95, max_chunks=2)
+
+# === 讀入 FAQ 文件並建立索引 ===
+# 已算過的段落從 .embedding_cache 讀取（memory-map），只有新增或修改過的段落才呼叫 API
+# 新段落每 100 段打包成一個請求，最多 4 個請求同時進行
+store = EmbeddingStore(".embedding_cache", EMBED_MODEL)
+embedder = BatchEmbedder(lambda texts: gemini_embed_many(texts, EMBED_MODEL))
+indexer = IncrementalIndexer(store, embedder, lambda: load_faq("faq.txt"))
+index_lock = threading.RLock()
+
+# 加上 --quantize=int8（或 float16 / pq）時，向量搜尋改在壓縮碼上計算（常駐記憶體約少 4 倍），
+# 前幾名再用 .embedding_cache 的原始向量精確重算（memory-map，只讀候選那幾列）
+QUANTIZE = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--quantize=")), None)
+
+# 本機 LocalEmbedder 的 IDF 存在 .embedding_cache，之後啟動與重新索引都沿用（向量才不會全部失效）；
+# 語料成長到 fit 時的兩倍以上才重新 fit
+LOCAL_EMBEDDER_PATH = os.path.join(".embedding_cache", "local_embedder.npz")
+
+def load_local_embedder(new_docs):
+    if os.path.exists(LOCAL_EMBEDDER_PATH):
+        local = LocalEmbedder.load(LOCAL_EMBEDDER_PATH)
+        if len(new_docs) <= 2 * local.n_docs:
+            return local
+    local = LocalEmbedder().fit(new_docs)
+    os.makedirs(os.path.dirname(LOCAL_EMBEDDER_PATH), exist_ok=True)
+    local.save(LOCAL_EMBEDDER_PATH)
+    return local
+
+def build_index(new_docs, new_embeddings):
+    """
+    建立向量搜尋與 BM25 關鍵字索引（像「退貨」這種問題不需要 embedding 就能找到），
+    另外用本機 LocalEmbedder 建一份向量索引，Gemini embedding 被限流或離線時改用它。
+    本機向量和 Gemini 向量一樣以段落內容為 key 快取在 .embedding_cache，只有新段落才需要計算。
+    """
+    global docs, embeddings, doc_pos, engine, bm25, searcher, local_embedder, local_engine
+    if QUANTIZE:
+        new_engine = QuantizedSearchEngine(new_embeddings, QUANTIZE, rescore_vectors=new_embeddings)
+    else:
+        new_engine = VectorSearchEngine(new_embeddings)
+    new_bm25 = BM25Index(new_docs)
+    new_local = load_local_embedder(new_docs)
+    local_store = EmbeddingStore(".embedding_cache", new_local.embed_model)
+    new_local_engine = VectorSearchEngine(local_store.embed_corpus(new_docs, new_local.embed_many))
+    with index_lock:
+        docs, embeddings, engine, bm25 = new_docs, new_embeddings, new_engine, new_bm25
+        local_embedder, local_engine = new_local, new_local_engine
+        doc_pos = {d: i for i, d in enumerate(docs)}
+        searcher = HybridSearcher(bm25, engine, embed_query)
+
+def on_faq_change(new_docs, new_embeddings, diff):
+    build_index(new_docs, new_embeddings)
+    print(f"\n🔁 [Watch] faq.txt 已更新：新增 {diff['added']}、刪除 {diff['removed']} 段")
+
+docs, embeddings, diff = indexer.sync()
+print(f"📚 FAQ 索引：新增 {diff['added']}、刪除 {diff['removed']}、沿用 {diff['unchanged']} 段")
+build_index(docs, embeddings)
+
+# 加上 --watch 參數時，faq.txt 一改就自動重新索引，不必重啟
+if "--watch" in sys.argv:
+    indexer.watch("faq.txt", on_faq_change)
+
+# === 相似度搜尋 ===
+def search_similar(query, top_k=2, trace=None):
+    """以 BM25 + cosine similarity 搜尋最相關的 FAQ 段落；--debug 時印出各階段的候選"""
+    trace = trace or Trace(query, LOG_LEVEL)
+    if trace.debug:
+        print("\n🔍 [DEBUG] 問題內容：", query)
+
+    # 1️⃣ 先查 BM25；關鍵字結果夠明確時直接回傳，不呼叫 embedding
+    with trace.stage("lexical"):
+        lex_idx, lex_scores, decisive = searcher.lexical(query, top_k)
+    if decisive:
+        trace.meta["mode"] = "lexical"
+        if trace.debug:
+            print("\n⚡ [DEBUG] 關鍵字結果明確，略過 embedding：")
+            for rank, (i, score) in enumerate(zip(lex_idx[:top_k], lex_scores), 1):
+                print(f"  TOP {rank}: BM25 {score:.3f} → {docs[i][:60]}")
+        return [docs[i] for i in lex_idx[:top_k]]
+    trace.meta["mode"] = "hybrid"
+
+    # 2️⃣ 取得 query 的 embedding（同一個問題只算一次）
+    misses = embed_query.misses
+    with trace.stage("query_embedding"):
+        try:
+            q_emb = embed_query(query)
+        except Exception as e:
+            # API 被限流或離線 → 改用本機 embedding，答案仍可照常產生（答案快取改以問題文字完全比對）
+            if trace.info:
+                print(f"\n🛟 [Fallback] Gemini embedding 失敗（{e}），改用本機 embedding")
+            q_emb = None
+            trace.meta["mode"] = "local"
+            trace.count("embed_failures")
+    trace.count("embed_calls", embed_query.misses - misses)
+
+    # 3️⃣ 一次矩陣乘法算出 cosine similarity，只取前 pool 名
+    with trace.stage("vector_search"):
+        if q_emb is not None:
+            emb_idx, emb_scores = engine.search(q_emb, searcher.pool)
+        else:
+            emb_idx, emb_scores = local_engine.search(local_embedder.embed(query), searcher.pool)
+
+    if trace.debug:
+        print(f"\n📊 [DEBUG] 相似度前 {len(emb_idx)} 名：")
+        for i, score in zip(emb_idx, emb_scores):
+            print(f"  ({i}) {score:.3f} → {docs[i][:60]}")
+
+    # 4️⃣ embedding 與 BM25 的排名以 RRF 合併，取前 k 名
+    with trace.stage("fusion"):
+        best_idx, best_scores = searcher.fuse(lex_idx, emb_idx, top_k)
+
+    if trace.debug:
+        print("\n🏆 [DEBUG] 選中前 {} 名：".format(top_k))
+        for rank, (i, score) in enumerate(zip(best_idx, best_scores), 1):
+            print(f"  TOP {rank}: RRF {score:.4f} → {docs[i][:60]}")
 
     # 5️⃣ 回傳選中的段落
     return [docs[i] for i in best_idx]
 
 
-# === 問題 ===
-question = input("請輸入問題：")
-context_list = search_similar(question)
-context = "\n".join(f"[資料來源{i+1}]\n{c}" for i, c in enumerate(context_list))
+# === 回答問題 ===
+model = genai.GenerativeModel("gemini-2.5-flash")
 
-# === 強化 Prompt ===
-prompt = f"""
+def answer_question(question):
+    trace = Trace(question, LOG_LEVEL)
+    try:
+        return _answer(question, trace)
+    finally:
+        metrics.record(trace)
+        if trace.info:
+            print(f"\n⏱️ [Trace] {trace.summary()}")
+
+def _answer(question, trace):
+    with index_lock:
+        retrieved = search_similar(question, top_k=4, trace=trace)
+
+    # 問題夠相似、檢索段落也相同 → 沿用上次的答案，不呼叫 LLM
+    # （走關鍵字快速路徑時沒有 embedding，改以問題文字完全比對）
+    # 快取的 key 一律用打包前的檢索結果，打包刪掉段落後仍能命中
+    q_emb = embed_query.get(question)
+    cached = answer_cache.lookup(q_emb, retrieved, query=question)
+    trace.count("answer_cache_hits", cached is not None)
+    if cached is not None:
+        if trace.info:
+            print(f"\n♻️ [Cache] 使用相似問題的答案（命中率 {answer_cache.hit_rate:.0%}）")
+        print("\n🤖 Gemini 回覆：", cached)
+        return cached
+
+    # 去掉近似重複的段落、以 MMR 挑選並控制在 token 預算內
+    with index_lock:
+        chunk_embs = embeddings[[doc_pos[c] for c in retrieved]]
+    with trace.stage("pack"):
+        context_list, pack_stats = packer.pack(q_emb, retrieved, chunk_embs)
+    if trace.info and pack_stats["tokens_saved"]:
+        print(f"\n✂️ [Context] 省下約 {pack_stats['tokens_saved']} 個 prompt token"
+              f"（重複 {pack_stats['dropped_duplicates']}、超出預算 {pack_stats['dropped_budget']} 段）")
+    context = format_context(context_list)
+
+    # === 強化 Prompt ===
+    prompt = f"""
 你是一個客服助理，必須根據我提供的 FAQ 內容回答問題。
 這些 FAQ 是系統已經從知識庫中查出的最相似資料來源。
 請務必根據它們回答問題，即使內容部份相關，也要根據現有資料進行合理推斷。
@@ -75,8 +217,26 @@ prompt = f"""
 {question}
 """
 
-# === 呼叫 Gemini ===
-model = genai.GenerativeModel("gemini-2.5-flash")
-response = model.generate_content(prompt, generation_config={"temperature": 0.2})
+    # === 呼叫 Gemini（串流輸出，邊生成邊印）===
+    print("\n🤖 Gemini 回覆：", end=" ", flush=True)
+    answer, timing = stream_generate(model, prompt, generation_config={"temperature": 0.2})
+    trace.stages["generation"] = timing["total"]
+    trace.meta["ttft_ms"] = timing["ttft"] * 1000
+    trace.count("generate_calls")
+    trace.count("prompt_tokens", estimate_tokens(prompt))
+    trace.count("output_tokens", estimate_tokens(answer))
+    if trace.info:
+        print(f"\n\n⏱️ 首字延遲 {timing['ttft']:.2f}s，總生成時間 {timing['total']:.2f}s")
+    answer_cache.store(q_emb, retrieved, answer, query=question)
+    return answer
+
 
-print("\n🤖 Gemini 回覆：", response.text)
\ No newline at end of file
+# === 問題 ===
+while True:
+    question = input("\n請輸入問題（輸入 exit 離開、stats 看統計）：").strip()
+    if question.lower() in ["exit", "quit"]:
+        break
+    if question.lower() == "stats":
+        print(json.dumps(metrics.summary(), ensure_ascii=False, indent=2))
+        continue
+    answer_question(question)
@@ -0,0 +1,115 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+# === Rerank 分數快取（SQLite）===
+# key = sha256(正規化後的問題 | 段落內容 hash | 模型 | prompt 版本)
+# 段落文字一改，content hash 就不同，舊分數自然不會再命中；
+# prune() 會順便把已不存在於 faq.txt 的段落分數刪掉。
+# 淘汰策略：超過 ttl 秒視為過期；超過 max_entries 筆時刪掉最久沒用到的（LRU）。
+
+
+def normalize_query(query: str) -> str:
+    """全半形統一、轉小寫、壓縮空白、去掉結尾標點"""
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?？!！。.").strip()
+
+
+def doc_hash(doc: str) -> str:
+    return hashlib.sha256(doc.encode("utf-8")).hexdigest()
+
+
+class RerankCache:
+    """持久化的 (問題, 段落) → 分數 快取，含 LRU/TTL 淘汰與命中率統計"""
+
+    def __init__(self, path=".rerank_cache.sqlite", model="gemini-2.5-flash",
+                 prompt_version="v1", max_entries=100_000, ttl=7 * 24 * 3600):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rerank_scores (
+                key TEXT PRIMARY KEY,
+                doc_hash TEXT NOT NULL,
+                score REAL NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_accessed ON rerank_scores(accessed)")
+        self._conn.commit()
+
+    def _key(self, query, d_hash):
+        raw = "|".join([normalize_query(query), d_hash, self.model, self.prompt_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rerank_scores").fetchone()[0]
+
+    # --- 查詢 ---
+    def get_many(self, query, docs):
+        """回傳與 docs 對齊的分數，沒命中（或已過期）的位置為 None"""
+        keys = [self._key(query, doc_hash(d)) for d in docs]
+        now = time.time()
+        with self._lock:
+            rows = dict(self._conn.execute(
+                f"SELECT key, score FROM rerank_scores WHERE key IN ({','.join('?' * len(keys))})"
+                " AND created >= ?", (*keys, now - self.ttl)).fetchall()) if keys else {}
+            if rows:
+                self._conn.executemany(
+                    "UPDATE rerank_scores SET accessed = ? WHERE key = ?",
+                    [(now, k) for k in rows])
+                self._conn.commit()
+        scores = [rows.get(k) for k in keys]
+        hit = sum(s is not None for s in scores)
+        self.hits += hit
+        self.misses += len(scores) - hit
+        return scores
+
+    # --- 寫入 ---
+    def put_many(self, query, docs, scores):
+        now = time.time()
+        records = []
+        for doc, score in zip(docs, scores):
+            h = doc_hash(doc)
+            records.append((self._key(query, h), h, float(score), now, now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rerank_scores VALUES (?, ?, ?, ?, ?)", records)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM rerank_scores WHERE created < ?",
+                           (time.time() - self.ttl,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM rerank_scores").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM rerank_scores WHERE key IN "
+                "(SELECT key FROM rerank_scores ORDER BY accessed LIMIT ?)", (excess,))
+
+    # --- 失效 ---
+    def prune(self, docs):
+        """刪掉不屬於目前 docs 的段落分數（faq.txt 改過或刪掉的段落），回傳刪除筆數"""
+        valid = {doc_hash(d) for d in docs}
+        with self._lock:
+            stale = [(h,) for (h,) in self._conn.execute(
+                "SELECT DISTINCT doc_hash FROM rerank_scores") if h not in valid]
+            cur = self._conn.executemany("DELETE FROM rerank_scores WHERE doc_hash = ?", stale)
+            self._conn.commit()
+        return cur.rowcount if stale else 0
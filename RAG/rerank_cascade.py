@@ -0,0 +1,96 @@
+import numpy as np
+
+# === 自適應 Rerank（cascade）===
+# 初篩分數（query 與候選的 cosine similarity）已經足夠明確時，不呼叫 LLM：
+#   1. 略過：只看 prompt 實際用到的深度 depth（例如只放 2 段就看第 2、3 名），
+#      第一名分數 ≥ min_score 且第 depth 名與第 depth+1 名的差距 ≥ margin 才略過；
+#      候選不超過 depth 個時沒有差距可比，一律 rerank
+#   2. 決定候選數：只送與第一名相差 window 以內的候選，至少 top_k、最多 max_candidates 個
+#      （分數集中在前面 → 送得少；分數很平 → 送得多，可以超過 baseline）
+#   3. 提早結束：先送初篩前 top_k 名，全部 ≥ accept 分就不再送其餘候選；
+#      沒過門檻才送剩下的（early_stop=False 時整批一次送出，例如 listwise）
+# score_fn(query, candidates) → 0-100 分數（例如 GeminiReranker.score）。
+# stats() 以「每次固定送 baseline 個候選」為基準；給了 call_counter（例如 lambda: reranker.calls）
+# 時，以實際送出的 LLM 請求數回報省下多少請求（候選數增加的查詢會算成多花的請求）。
+
+
+class RerankCascade:
+    def __init__(self, score_fn, margin=0.08, min_score=0.5, window=0.1, max_candidates=8,
+                 accept=80.0, baseline=5, early_stop=True, call_counter=None):
+        self.score_fn = score_fn
+        self.margin = margin
+        self.min_score = min_score
+        self.window = window
+        self.max_candidates = max_candidates
+        self.accept = accept
+        self.baseline = baseline
+        self.early_stop = early_stop
+        self.call_counter = call_counter
+        self._calls_start = call_counter() if call_counter else 0
+        self.queries = 0
+        self.skipped = 0
+        self.early_stopped = 0
+        self.grown = 0
+        self.scored = 0
+
+    def is_decisive(self, scores, depth):
+        if len(scores) <= depth:
+            return False
+        return scores[0] >= self.min_score and scores[depth - 1] - scores[depth] >= self.margin
+
+    def candidate_count(self, scores, top_k):
+        close = int(np.sum(np.asarray(scores) >= scores[0] - self.window))
+        return min(max(close, top_k), self.max_candidates, len(scores))
+
+    def rank(self, query, candidates, scores, top_k=3, depth=None, decisive=False):
+        """
+        candidates 依初篩分數由高到低排列，scores 為對應的 cosine similarity（None 表示沒有）。
+        depth 為 prompt 實際用到的段落數（預設 top_k），是否略過 rerank 以這個深度判斷。
+        decisive=True 表示上游已判定結果明確（例如 BM25 快速路徑）。
+        回傳 (選中的候選索引, 分數, 決策)；決策為 "skip" / "early_stop" / "rerank"，
+        "skip" 時分數為初篩分數，其餘為 rerank 分數。
+        """
+        self.queries += 1
+        depth = min(depth or top_k, top_k)
+        scores = None if scores is None else np.asarray(scores, dtype=np.float32)
+        if decisive or len(candidates) <= 1 or (scores is not None and self.is_decisive(scores, depth)):
+            self.skipped += 1
+            idx = np.arange(min(top_k, len(candidates)))
+            return idx, (scores[idx] if scores is not None else np.zeros(len(idx))), "skip"
+
+        n = self.candidate_count(scores, top_k) if scores is not None else min(self.baseline, len(candidates))
+        if n > self.baseline:
+            self.grown += 1
+        first = min(top_k, n) if self.early_stop else n
+        rerank_scores = np.asarray(self.score_fn(query, candidates[:first]), dtype=np.float64)
+        decision = "rerank"
+        if first < n and rerank_scores.min() >= self.accept:
+            self.early_stopped += 1
+            decision = "early_stop"
+            n = first
+        elif first < n:
+            rerank_scores = np.concatenate([rerank_scores, self.score_fn(query, candidates[first:n])])
+        self.scored += n
+
+        order = np.argsort(-rerank_scores, kind="stable")[:top_k]
+        return order, rerank_scores[order], decision
+
+    def stats(self):
+        baseline = self.queries * self.baseline
+        stats = {
+            "queries": self.queries,
+            "skipped": self.skipped,
+            "early_stopped": self.early_stopped,
+            "grown": self.grown,
+            "candidates_scored": self.scored,
+        }
+        if self.call_counter is None:
+            stats["candidates_avoided"] = baseline - self.scored
+            stats["avoided_ratio"] = 1 - self.scored / baseline if baseline else 0.0
+        else:
+            # 實際 LLM 請求數（快取命中不算）；候選數超過 baseline 的查詢會讓這裡變少
+            calls = self.call_counter() - self._calls_start
+            stats["llm_calls"] = calls
+            stats["llm_calls_avoided"] = baseline - calls
+            stats["avoided_ratio"] = 1 - calls / baseline if baseline else 0.0
+        return stats
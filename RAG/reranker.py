@@ -0,0 +1,170 @@
+import re
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# === Gemini Reranker ===
+# 兩種模式：
+#   pointwise → 每個候選一個 prompt，同時最多 max_concurrency 個請求
+#   listwise  → 所有候選放進同一個 prompt，要求以 JSON 回傳每個候選的分數
+# 整個 reranker 共用同一個 GenerativeModel；單一請求逾時只會讓該候選得 0 分。
+# 有給 RerankCache 時，只對沒命中的候選呼叫 LLM；逾時或失敗的分數不寫入快取。
+
+# prompt 內容有改時要調整版本，舊的快取分數才不會被沿用
+PROMPT_VERSION = "v1"
+
+POINTWISE_PROMPT = """請評估以下「問題」和「FAQ 內容」的相關度。
+
+問題：{query}
+
+FAQ 內容：
+{doc}
+
+請只回答一個 0-100 的數字分數：
+- 100分：完全相關，FAQ 直接回答了問題
+- 50分：部分相關，有提到相關主題
+- 0分：完全不相關
+
+分數："""
+
+LISTWISE_PROMPT = """請評估以下每一段「FAQ 內容」和「問題」的相關度，給 0-100 的分數：
+- 100分：完全相關，FAQ 直接回答了問題
+- 50分：部分相關，有提到相關主題
+- 0分：完全不相關
+
+問題：{query}
+
+{candidates}
+
+請只回傳 JSON 陣列，每個候選一個物件，例如：
+[{{"id": 1, "score": 90}}, {{"id": 2, "score": 10}}]"""
+
+
+def parse_score(text):
+    """取出回覆中的第一個數字並限制在 0-100"""
+    match = re.search(r"\d+(?:\.\d+)?", text)
+    if not match:
+        raise ValueError(f"回覆中沒有分數：{text!r}")
+    return min(max(float(match.group()), 0.0), 100.0)
+
+
+def parse_listwise(text, n):
+    """解析 listwise 的 JSON 回覆，缺少的候選給 0 分"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    scores = [0.0] * n
+    for item in json.loads(text):
+        idx = int(item["id"]) - 1
+        if 0 <= idx < n:
+            scores[idx] = min(max(float(item["score"]), 0.0), 100.0)
+    return scores
+
+
+class GeminiReranker:
+    """重複使用同一個 model，對候選文件併發（或一次）打分數"""
+
+    def __init__(self, model=None, model_name="gemini-2.5-flash", mode="pointwise",
+                 max_concurrency=5, timeout=15.0, cache=None, verbose=True):
+        if model is None:
+            import google.generativeai as genai
+            model = genai.GenerativeModel(model_name)
+        if mode not in ("pointwise", "listwise"):
+            raise ValueError(f"未知的 rerank 模式：{mode}")
+        self.model = model
+        self.mode = mode
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.verbose = verbose
+        self.calls = 0  # 實際送出的 LLM 請求數（快取命中不算）
+        self._calls_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def _generate(self, prompt, **config):
+        with self._calls_lock:
+            self.calls += 1
+        return self.model.generate_content(
+            prompt,
+            generation_config={"temperature": 0, **config},
+            request_options={"timeout": self.timeout},
+        )
+
+    def _score_one(self, query, doc):
+        response = self._generate(POINTWISE_PROMPT.format(query=query, doc=doc))
+        return parse_score(response.text.strip())
+
+    # --- pointwise：併發評分 ---
+    def _score_pointwise(self, query, candidates):
+        futures = [self._pool.submit(self._score_one, query, doc) for doc in candidates]
+        # 併發上限下最多要跑幾輪，整體等待時間以此為上限
+        rounds = -(-len(candidates) // self.max_concurrency)
+        wait(futures, timeout=self.timeout * rounds)
+
+        scores = []
+        for idx, (future, doc) in enumerate(zip(futures, candidates)):
+            if not future.done():
+                future.cancel()
+                if self.verbose:
+                    print(f"  候選 {idx+1}: 評分逾時")
+                scores.append(None)
+                continue
+            try:
+                score = future.result()
+                if self.verbose:
+                    print(f"  候選 {idx+1}: {score:.0f} 分 → {doc[:50]}...")
+            except Exception as e:
+                if self.verbose:
+                    print(f"  候選 {idx+1}: 評分失敗 ({e})")
+                score = None
+            scores.append(score)
+        return scores
+
+    # --- listwise：一個 prompt 評所有候選 ---
+    def _score_listwise(self, query, candidates):
+        listing = "\n\n".join(f"[候選 {i+1}]\n{doc}" for i, doc in enumerate(candidates))
+        try:
+            response = self._generate(
+                LISTWISE_PROMPT.format(query=query, candidates=listing),
+                response_mime_type="application/json",
+            )
+            scores = parse_listwise(response.text, len(candidates))
+        except Exception as e:
+            if self.verbose:
+                print(f"  listwise 評分失敗 ({e})")
+            return [None] * len(candidates)
+        if self.verbose:
+            for idx, (score, doc) in enumerate(zip(scores, candidates)):
+                print(f"  候選 {idx+1}: {score:.0f} 分 → {doc[:50]}...")
+        return scores
+
+    @property
+    def prompt_version(self):
+        return f"{self.mode}-{PROMPT_VERSION}"
+
+    def _score_uncached(self, query, candidates):
+        """回傳分數，失敗或逾時的位置為 None"""
+        if not candidates:
+            return []
+        if self.mode == "listwise":
+            return self._score_listwise(query, candidates)
+        return self._score_pointwise(query, candidates)
+
+    def score(self, query, candidates):
+        """回傳與 candidates 對齊的 0-100 分數（失敗或逾時為 0）"""
+        if self.cache is None:
+            return [s or 0.0 for s in self._score_uncached(query, candidates)]
+
+        scores = self.cache.get_many(query, candidates)
+        todo = [i for i, s in enumerate(scores) if s is None]
+        if self.verbose and len(todo) < len(candidates):
+            print(f"  ♻️ 快取命中 {len(candidates) - len(todo)}/{len(candidates)}"
+                  f"（累計命中率 {self.cache.hit_rate:.0%}）")
+
+        fresh = self._score_uncached(query, [candidates[i] for i in todo])
+        done = [(candidates[i], s) for i, s in zip(todo, fresh) if s is not None]
+        if done:
+            self.cache.put_many(query, *zip(*done))
+        for i, s in zip(todo, fresh):
+            scores[i] = s
+        return [s or 0.0 for s in scores]
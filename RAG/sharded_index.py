@@ -0,0 +1,186 @@
+import os
+import json
+import heapq
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from vector_search import normalize_rows, top_k_indices
+
+# === 分片向量索引（scatter-gather）===
+# 語料切成多個 shard，每個 shard 存成一個目錄：
+#   vectors.npy（正規化後的 float32）、ids.npy（全域文件索引 int64）
+# 分片方式：預設依段落內容雜湊平均分配；給 shard_key(i, doc) 則依租戶 / 分類分組，
+# 查詢時可以只搜尋相關的 shard。
+# 查詢流程：各 shard 在 worker process 中各自算出前 k 名 → 協調端以 heap 合併。
+# shard 第一次被搜尋時才以 memory-map 載入；同一台機器的 worker 共用 OS page cache。
+
+MANIFEST = "shards.json"
+
+
+def hash_shard(doc, n_shards):
+    """依段落內容決定 shard（與文件順序無關，重建時同一段落落在同一個 shard）"""
+    digest = hashlib.sha256(doc.encode("utf-8")).digest()
+    return f"{int.from_bytes(digest[:8], 'little') % n_shards:03d}"
+
+
+def build_shards(directory, docs, embeddings, n_shards=8, shard_key=None):
+    """
+    把 (docs, embeddings) 切成 shard 寫入 directory，回傳 {shard 名稱: 段落數}。
+    shard_key(i, doc) 回傳 shard 名稱（例如租戶 ID）；未提供時依內容雜湊分成 n_shards 份。
+    """
+    key = shard_key or (lambda i, doc: hash_shard(doc, n_shards))
+    groups = {}
+    for i, doc in enumerate(docs):
+        groups.setdefault(str(key(i, doc)), []).append(i)
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    for name, ids in sorted(groups.items()):
+        shard_dir = os.path.join(directory, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        ids = np.asarray(ids, dtype=np.int64)
+        np.save(os.path.join(shard_dir, "vectors.npy"), normalize_rows(embeddings[ids]))
+        np.save(os.path.join(shard_dir, "ids.npy"), ids)
+        counts[name] = len(ids)
+
+    tmp = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"dim": int(embeddings.shape[1]), "count": len(docs), "shards": counts}, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+    return counts
+
+
+# --- worker 端：每個 process 各自快取已載入的 shard ---
+_loaded = {}
+
+
+def _load_shard(shard_dir):
+    if shard_dir not in _loaded:
+        _loaded[shard_dir] = (np.load(os.path.join(shard_dir, "vectors.npy"), mmap_mode="r"),
+                              np.load(os.path.join(shard_dir, "ids.npy"), mmap_mode="r"))
+    return _loaded[shard_dir]
+
+
+def _search_shard(shard_dir, queries, top_k):
+    """單一 shard 的前 k 名：回傳 (全域索引 (Q, k), 分數 (Q, k))"""
+    vectors, ids = _load_shard(shard_dir)
+    sims = queries @ vectors.T
+    idx = top_k_indices(sims, top_k)
+    return ids[idx], np.take_along_axis(sims, idx, axis=-1)
+
+
+class ShardedIndex:
+    """
+    search / search_batch 介面與 VectorSearchEngine 相同，可直接給 HybridSearcher 使用。
+    workers=0 時在本 process 依序搜尋（shard 少、語料小時省下 IPC 成本）。
+    """
+
+    def __init__(self, directory, workers=None):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.shards = meta["shards"]
+        self.workers = os.cpu_count() if workers is None else workers
+        self._pool = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def pool(self):
+        if self._pool is None and self.workers:
+            self._pool = ProcessPoolExecutor(max_workers=min(self.workers, len(self.shards)))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _select(self, shards):
+        if shards is None:
+            return [name for name, n in self.shards.items() if n]
+        unknown = set(shards) - set(self.shards)
+        if unknown:
+            raise KeyError(f"沒有這些 shard：{sorted(unknown)}")
+        return [name for name in shards if self.shards[name]]
+
+    def search_batch(self, queries, top_k=5, shards=None):
+        """
+        多個 query 對選定的 shard（預設全部）搜尋，回傳 (索引 (Q, k), 分數 (Q, k))。
+        各 shard 的前 k 名以 heap 合併成全域前 k 名。
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        names = self._select(shards)
+        dirs = [os.path.join(self.directory, name) for name in names]
+        if self.pool is None:
+            parts = [_search_shard(d, queries, top_k) for d in dirs]
+        else:
+            futures = [self.pool.submit(_search_shard, d, queries, top_k) for d in dirs]
+            parts = [f.result() for f in futures]
+
+        # 沒有選到任何非空 shard 時 k = 0，回傳 (Q, 0) 的空結果
+        k = min(top_k, sum(self.shards[name] for name in names))
+        out_idx = np.empty((len(queries), k), dtype=np.int64)
+        out_scores = np.empty((len(queries), k), dtype=np.float32)
+        for q in range(len(queries) if k else 0):
+            # 每個 shard 的結果已由高到低排序，merge 後取前 k 個即可
+            runs = [zip(-scores[q], ids[q]) for ids, scores in parts]
+            best = list(heapq.merge(*runs))[:k] if len(parts) > 1 else list(runs[0])[:k]
+            out_idx[q] = [i for _, i in best]
+            out_scores[q] = [-s for s, _ in best]
+        return out_idx, out_scores
+
+    def search(self, query, top_k=5, shards=None):
+        """回傳 (索引, 分數)，由高到低排序"""
+        idx, scores = self.search_batch(query, top_k, shards)
+        return idx[0], scores[0]
+
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import argparse
+    import tempfile
+    from vector_search import VectorSearchEngine
+
+    parser = argparse.ArgumentParser(description="分片索引與單一索引的查詢速度比較（隨機資料）")
+    parser.add_argument("--n", type=int, default=1_000_000, help="文件數")
+    parser.add_argument("--dim", type=int, default=256, help="向量維度")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(args.n, args.dim)).astype(np.float32)
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    docs = [str(i) for i in range(args.n)]
+
+    workdir = tempfile.mkdtemp(prefix="shards-")
+    try:
+        start = time.perf_counter()
+        build_shards(workdir, docs, data, n_shards=args.shards)
+        print(f"🏗️ 建立 {args.shards} 個 shard：{time.perf_counter() - start:.2f}s")
+
+        engine = VectorSearchEngine(data)
+        index = ShardedIndex(workdir, workers=args.workers)
+        index.search(queries[0], args.k)  # 啟動 worker 並載入 shard
+
+        for name, searcher in (("單一", engine), ("分片", index)):
+            start = time.perf_counter()
+            idx, _ = searcher.search_batch(queries, args.k)
+            elapsed = time.perf_counter() - start
+            print(f"  {name}：{args.queries / elapsed:.0f} QPS")
+            if name == "單一":
+                exact = idx
+        same = np.mean([set(a) == set(b) for a, b in zip(exact.tolist(), idx.tolist())])
+        print(f"  結果一致：{same:.0%}")
+        index.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
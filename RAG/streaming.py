@@ -0,0 +1,30 @@
+import time
+
+# === 串流生成 ===
+# generate_content(stream=True) 會邊生成邊回傳片段；收到就印出，
+# 同時記錄首字延遲（TTFT）與總生成時間。
+
+
+def print_chunk(text):
+    print(text, end="", flush=True)
+
+
+def stream_generate(model, prompt, generation_config=None, on_text=print_chunk):
+    """回傳 (完整回覆, {"ttft": 秒, "total": 秒})；on_text 會收到每個文字片段"""
+    start = time.perf_counter()
+    first = None
+    parts = []
+    for chunk in model.generate_content(prompt, generation_config=generation_config, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:
+            # 沒有文字的片段（例如只帶 finish_reason / 安全評分）
+            continue
+        if not text:
+            continue
+        if first is None:
+            first = time.perf_counter() - start
+        parts.append(text)
+        on_text(text)
+    total = time.perf_counter() - start
+    return "".join(parts), {"ttft": first if first is not None else total, "total": total}
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# === 每個請求的階段計時與計數 ===
+# Trace 記錄一個問題經過的各階段耗時（query embedding、向量搜尋、rerank、生成…）
+# 與計數（API 呼叫次數、token 數），Metrics 彙總所有請求並可輸出成 JSONL。
+# 除錯輸出分級：OFF < INFO < DEBUG；呼叫端先檢查 trace.debug / trace.info 再組字串，
+# 關閉時不會做任何格式化。
+#
+#   --debug / --quiet 參數或環境變數 RAG_LOG_LEVEL=off|info|debug 決定等級
+#   環境變數 RAG_TRACE_FILE=traces.jsonl 時，每個請求的 trace 會附加寫入該檔
+
+OFF, INFO, DEBUG = 0, 1, 2
+LEVELS = {"off": OFF, "info": INFO, "debug": DEBUG}
+
+
+def log_level(argv=(), default=INFO):
+    """命令列 --debug / --quiet 優先，其次 RAG_LOG_LEVEL"""
+    if "--debug" in argv:
+        return DEBUG
+    if "--quiet" in argv:
+        return OFF
+    return LEVELS.get(os.getenv("RAG_LOG_LEVEL", "").lower(), default)
+
+
+class Trace:
+    def __init__(self, query="", level=INFO):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.level = level
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.meta = {}
+
+    @property
+    def info(self):
+        return self.level >= INFO
+
+    @property
+    def debug(self):
+        return self.level >= DEBUG
+
+    @contextmanager
+    def stage(self, name):
+        """累加 with 區塊的耗時（同名階段出現多次時相加）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        if n:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        return "｜".join(f"{name} {sec * 1000:.1f}ms" for name, sec in self.stages.items())
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "query": self.query,
+            "started": self.started,
+            "stages_ms": {k: v * 1000 for k, v in self.stages.items()},
+            "counters": self.counters,
+            **self.meta,
+        }
+
+
+class _NullTrace(Trace):
+    """沒有傳入 trace 時使用：不計時、不計數、不輸出"""
+
+    def __init__(self):
+        super().__init__(level=OFF)
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Metrics:
+    """彙總各請求的 trace；每個階段保留最近 window 筆耗時計算 p50/p99"""
+
+    def __init__(self, path=None, window=10_000):
+        self.path = path
+        self.window = window
+        self.requests = 0
+        self.counters = {}
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            self.requests += 1
+            for name, sec in trace.stages.items():
+                self._stages.setdefault(name, deque(maxlen=self.window)).append(sec)
+            for name, n in trace.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for name, samples in self._stages.items():
+                ms = np.asarray(samples) * 1000
+                stages[name] = {
+                    "count": len(ms),
+                    "p50_ms": float(np.percentile(ms, 50)),
+                    "p99_ms": float(np.percentile(ms, 99)),
+                }
+            return {"requests": self.requests, "stages": stages, "counters": dict(self.counters)}
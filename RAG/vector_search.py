@@ -0,0 +1,53 @@
+import numpy as np
+
+# === 向量化的 Top-k 相似度搜尋 ===
+# 文件向量在建立時就先正規化成連續的 float32 矩陣，
+# 查詢時只需一次矩陣乘法，再用 argpartition 取前 k 名（不做整體排序）。
+
+
+def normalize_rows(matrix):
+    """把每一列正規化成單位向量（零向量維持為零）"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+    """沿最後一軸取分數最高的 k 個索引（由高到低），使用部分選取"""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class VectorSearchEngine:
+    """保存正規化後的文件矩陣，以 cosine similarity 搜尋"""
+
+    def __init__(self, embeddings):
+        self.matrix = np.ascontiguousarray(normalize_rows(embeddings))
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def scores(self, query):
+        """單一 query 對所有文件的 cosine similarity"""
+        return self.matrix @ normalize_rows(query)
+
+    def search(self, query, top_k=5):
+        """回傳 (索引, 分數)，由高到低排序"""
+        sims = self.scores(query)
+        idx = top_k_indices(sims, top_k)
+        return idx, sims[idx]
+
+    def search_batch(self, queries, top_k=5):
+        """多個 query 一次算完：(Q, d) × (d, N) → 各自的前 k 名"""
+        sims = normalize_rows(queries) @ self.matrix.T
+        idx = top_k_indices(sims, top_k)
+        return idx, np.take_along_axis(sims, idx, axis=-1)
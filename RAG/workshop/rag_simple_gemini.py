@@ -1,134 +1,226 @@
 import os
+import sys
+import json
+import threading
 import numpy as np
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+# 共用模組放在上一層 RAG/ 資料夾
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_store import EmbeddingStore
+from batch_embed import BatchEmbedder, gemini_embed_many
+from vector_search import VectorSearchEngine, normalize_rows
+from ann_index import IVFIndex
+from reranker import GeminiReranker, PROMPT_VERSION
+from rerank_cascade import RerankCascade
+from rerank_cache import RerankCache
+from query_cache import QueryEmbeddingCache, SemanticAnswerCache
+from bm25 import BM25Index, HybridSearcher
+from streaming import stream_generate
+from incremental_index import IncrementalIndexer, load_faq
+from context_packer import ContextPacker, format_context
+from chunker import estimate_tokens
+from tracing import Trace, Metrics, log_level, DEBUG
+
 # === 初始化 ===
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# === 讀入 FAQ 文件 ===
-docs = []
-with open("faq.txt", "r", encoding="utf-8") as f:
-    chunks = f.read().strip().split("\n\n")
-    for chunk in chunks:
-        docs.append(chunk.strip())
+# === 除錯輸出與追蹤 ===
+# 預設只印各階段摘要；加上 --debug 印出初篩與 rerank 的逐筆分數，--quiet 全部關閉
+# 設定 RAG_TRACE_FILE 時，每個問題的階段耗時與計數會寫成一行 JSON
+LOG_LEVEL = log_level(sys.argv)
+metrics = Metrics(path=os.getenv("RAG_TRACE_FILE"))
 
 # === 文字轉向量 ===
+EMBED_MODEL = "models/text-embedding-004"
+
 def embed_text(text: str):
     """使用 Gemini 的 embedding 模型將文字轉換為向量"""
-    res = genai.embed_content(model="models/text-embedding-004", content=text)
+    res = genai.embed_content(model=EMBED_MODEL, content=text)
     return np.array(res["embedding"])
 
-embeddings = [embed_text(doc) for doc in docs]
+# === 查詢快取 ===
+# 同一個問題不重算 embedding；相似問題且初篩候選相同時，直接重用上次的答案（連 rerank 都省掉）
+embed_query = QueryEmbeddingCache(embed_text)
+answer_cache = SemanticAnswerCache(threshold=0.95)
 
-# === 原本的 Embedding 搜尋（初篩用）===
-def search_similar_embedding(query, top_k=5):
-    """用 embedding 快速篩選候選文件"""
-    q_emb = embed_text(query)
-    
-    sims = []
-    for d_emb in embeddings:
-        sim = np.dot(q_emb, d_emb) / (np.linalg.norm(q_emb) * np.linalg.norm(d_emb))
-        sims.append(sim)
-    
-    sorted_idx = np.argsort(sims)[::-1]
-    return [docs[i] for i in sorted_idx[:top_k]], sims
+# === Prompt 資料來源組裝 ===
+# rerank 取 3 段，prompt 最多放 2 段（與加入打包前相同）；第 3 段只在有重複段落被剔除時遞補
+packer = ContextPacker(max_tokens=1500, dedup_threshold=0.95, max_chunks=2)
+
+# === 讀入 FAQ 文件並建立索引 ===
+# 已算過的段落從 .embedding_cache 讀取（memory-map），只有新增或修改過的段落才呼叫 API
+# 新段落每 100 段打包成一個請求，最多 4 個請求同時進行
+store = EmbeddingStore(".embedding_cache", EMBED_MODEL)
+embedder = BatchEmbedder(lambda texts: gemini_embed_many(texts, EMBED_MODEL))
+indexer = IncrementalIndexer(store, embedder, lambda: load_faq("faq.txt"))
+index_lock = threading.RLock()
+
+# 語料很大時改用 IVF 近似搜尋（search 介面相同，nlist 取約 √N）
+ANN_THRESHOLD = 100_000
+
+def build_index(new_docs, new_embeddings):
+    """建立向量索引與 BM25 關鍵字索引（關鍵字明確的問題直接用 BM25，否則以 RRF 合併）"""
+    global docs, embeddings, doc_pos, engine, bm25, searcher
+    if len(new_docs) > ANN_THRESHOLD:
+        new_engine = IVFIndex(nlist=int(np.sqrt(len(new_docs))), nprobe=16).build(new_embeddings)
+    else:
+        new_engine = VectorSearchEngine(new_embeddings)
+    new_bm25 = BM25Index(new_docs)
+    with index_lock:
+        docs, embeddings, engine, bm25 = new_docs, new_embeddings, new_engine, new_bm25
+        doc_pos = {d: i for i, d in enumerate(docs)}
+        searcher = HybridSearcher(bm25, engine, embed_query)
+
+def on_faq_change(new_docs, new_embeddings, diff):
+    build_index(new_docs, new_embeddings)
+    rerank_cache.prune(new_docs)
+    print(f"\n🔁 [Watch] faq.txt 已更新：新增 {diff['added']}、刪除 {diff['removed']} 段")
+
+docs, embeddings, diff = indexer.sync()
+print(f"📚 FAQ 索引：新增 {diff['added']}、刪除 {diff['removed']}、沿用 {diff['unchanged']} 段")
+build_index(docs, embeddings)
+
+# === 初篩：BM25 + Embedding 混合檢索 ===
+def search_similar_embedding(query, top_k=5, trace=None):
+    """用 BM25 / embedding 快速篩選候選文件，回傳 (候選段落, 對應分數（由高到低）, 模式)"""
+    trace = trace or Trace(query, LOG_LEVEL)
+    misses = embed_query.misses
+    best_idx, best_scores, mode = searcher.search(query, top_k, trace=trace)
+    trace.count("embed_calls", embed_query.misses - misses)
+    trace.meta["mode"] = mode
+    if trace.debug and mode == "lexical":
+        print("⚡ 關鍵字結果明確，略過 embedding")
+    return [docs[i] for i in best_idx], best_scores, mode
 
 
 # === 🔥 新增：Reranker 重排序 ===
+# 共用同一個 model；pointwise 模式最多 5 個候選同時評分，單一候選逾時只會得 0 分
+# 改成 RERANK_MODE = "listwise" 則所有候選用一個 prompt 評分（JSON 輸出）
+# 評過的 (問題, 段落) 分數存在 .rerank_cache.sqlite，faq.txt 改過的段落會自動失效
+RERANK_MODEL = "gemini-2.5-flash"
+RERANK_MODE = "pointwise"
+rerank_cache = RerankCache(model=RERANK_MODEL, prompt_version=f"{RERANK_MODE}-{PROMPT_VERSION}")
+rerank_cache.prune(docs)
+reranker = GeminiReranker(model_name=RERANK_MODEL, mode=RERANK_MODE, max_concurrency=5,
+                          timeout=15.0, cache=rerank_cache, verbose=LOG_LEVEL >= DEBUG)
+
 def rerank_with_gemini(query, candidates):
     """使用 Gemini 對候選文件重新打分數"""
-    
-    print(f"\n🔄 [Reranker] 正在重新評估 {len(candidates)} 個候選...")
-    
-    scores = []
-    for idx, doc in enumerate(candidates):
-        # 用 Gemini 直接評分：問題和答案的相關度
-        prompt = f"""請評估以下「問題」和「FAQ 內容」的相關度。
-
-問題：{query}
-
-FAQ 內容：
-{doc}
-
-請只回答一個 0-100 的數字分數：
-- 100分：完全相關，FAQ 直接回答了問題
-- 50分：部分相關，有提到相關主題
-- 0分：完全不相關
-
-分數："""
-        
-        try:
-            model = genai.GenerativeModel("gemini-2.5-flash")
-            response = model.generate_content(
-                prompt, 
-                generation_config={"temperature": 0}
-            )
-
-            # 印出 response 的原始內容
-            print(f"  候選 {idx+1} 回覆：{response.text.strip()}")
-
-            # 提取數字分數
-            score_text = response.text.strip()
-            score = float(''.join(filter(str.isdigit, score_text)))
-            scores.append(score)
-            
-            print(f"  候選 {idx+1}: {score:.0f} 分 → {doc[:50]}...")
-            
-        except Exception as e:
-            print(f"  候選 {idx+1}: 評分失敗 ({e})")
-            scores.append(0)
-    
-    return scores
+    if LOG_LEVEL >= DEBUG:
+        print(f"\n🔄 [Reranker] 正在重新評估 {len(candidates)} 個候選...")
+    return reranker.score(query, candidates)
 
+# 初篩結果已經很明確時不呼叫 reranker（以 prompt 實際放入的段落數判斷）；
+# 候選數依分數分佈在 top_k ~ 8 個之間調整，先評前 top_k 名，都拿到 80 分以上就不再評其餘候選
+# （listwise 模式一次評完整批，不做提早結束）
+cascade = RerankCascade(rerank_with_gemini, margin=0.08, min_score=0.5, window=0.1,
+                        max_candidates=8, accept=80.0, baseline=5,
+                        early_stop=(RERANK_MODE == "pointwise"), call_counter=lambda: reranker.calls)
+CANDIDATES = cascade.max_candidates
 
-# === 主搜尋函數（含完整 debug）===
-def search_with_rerank(query, top_k=2):
+
+# === 主搜尋函數（--debug 時印出完整過程）===
+def search_with_rerank(query, top_k=2, trace=None, first_stage=None):
     """
     兩階段檢索：
-    1. Embedding 快速篩選前 5 名
-    2. Reranker 精準重排序，取前 top_k 名
+    1. BM25 + Embedding 快速篩選前 CANDIDATES 名
+       （first_stage 為已做過的初篩結果 (候選, 分數, 模式) 時直接沿用，不再搜尋一次）
+    2. 初篩不夠明確時才用 Reranker 精準重排序，取前 top_k 名
     """
-    
-    print("\n" + "="*60)
-    print(f"🔍 問題：{query}")
-    print("="*60)
-    
+    trace = trace or Trace(query, LOG_LEVEL)
+    if trace.debug:
+        print("\n" + "="*60)
+        print(f"🔍 問題：{query}")
+        print("="*60)
+        print("\n【階段 1】BM25 + Embedding 快速篩選")
+
     # === 階段 1：Embedding 初篩 ===
-    print("\n【階段 1】Embedding 快速篩選")
-    candidates, emb_scores = search_similar_embedding(query, top_k=5)
-    
-    print("\n📊 Embedding 相似度分數：")
-    sorted_idx = np.argsort(emb_scores)[::-1][:5]
-    for rank, i in enumerate(sorted_idx, 1):
-        print(f"  第 {rank} 名: {emb_scores[i]:.3f} → {docs[i][:60]}...")
-    
-    # === 階段 2：Reranker 重排序 ===
-    print("\n【階段 2】Reranker 精準重排")
-    rerank_scores = rerank_with_gemini(query, candidates)
-    
-    # 排序
-    rerank_idx = np.argsort(rerank_scores)[::-1]
-    
-    print("\n🏆 最終排序結果：")
-    for rank, i in enumerate(rerank_idx[:top_k], 1):
-        print(f"  第 {rank} 名: {rerank_scores[i]:.0f} 分")
-        print(f"         → {candidates[i][:60]}...")
-    
-    print("\n" + "="*60)
-    
+    if first_stage is None:
+        first_stage = search_similar_embedding(query, top_k=CANDIDATES, trace=trace)
+    candidates, first_scores, mode = first_stage
+
+    # cascade 以 cosine similarity 判斷是否明確，候選依 cosine 由高到低排列
+    q_emb = embed_query.get(query)
+    sims = None
+    if q_emb is not None and candidates:
+        with index_lock:
+            cand_embs = embeddings[[doc_pos[c] for c in candidates]]
+        sims = normalize_rows(cand_embs) @ normalize_rows(q_emb)
+        order = np.argsort(-sims, kind="stable")
+        candidates, first_scores, sims = [candidates[i] for i in order], sims[order], sims[order]
+
+    if trace.debug:
+        print("\n📊 初篩分數：")
+        for rank, (score, doc) in enumerate(zip(first_scores, candidates), 1):
+            print(f"  第 {rank} 名: {score:.3f} → {doc[:60]}...")
+        print("\n【階段 2】Reranker 精準重排")
+
+    # === 階段 2：Reranker 重排序（cascade）===
+    calls = reranker.calls
+    with trace.stage("rerank"):
+        rerank_idx, rerank_scores, decision = cascade.rank(
+            query, candidates, sims, top_k=top_k, depth=packer.max_chunks, decisive=(mode == "lexical"))
+    trace.count("rerank_calls", reranker.calls - calls)
+    trace.meta["rerank"] = decision
+
+    if trace.debug:
+        if decision == "skip":
+            print("  ⏭️ 初篩結果明確，略過 Reranker")
+        elif decision == "early_stop":
+            print(f"  ✋ 前 {top_k} 名都達 {cascade.accept:.0f} 分，不再評其餘候選")
+        print("\n🏆 最終排序結果：")
+        for rank, (i, score) in enumerate(zip(rerank_idx, rerank_scores), 1):
+            print(f"  第 {rank} 名: {score:.3f}" if decision == "skip" else f"  第 {rank} 名: {score:.0f} 分")
+            print(f"         → {candidates[i][:60]}...")
+        print("\n" + "="*60)
+
     # 回傳最終結果
-    return [candidates[i] for i in rerank_idx[:top_k]]
+    return [candidates[i] for i in rerank_idx]
 
 
-# === 主程式 ===
-if __name__ == "__main__":
-    question = input("\n請輸入問題：")
-    
-    # 使用 Reranker 檢索
-    context_list = search_with_rerank(question, top_k=2)
-    context = "\n".join(f"[資料來源{i+1}]\n{c}" for i, c in enumerate(context_list))
+# === 回答問題 ===
+model = genai.GenerativeModel("gemini-2.5-flash")
+
+def answer_question(question):
+    trace = Trace(question, LOG_LEVEL)
+    try:
+        return _answer(question, trace)
+    finally:
+        metrics.record(trace)
+        if trace.info:
+            print(f"\n⏱️ [Trace] {trace.summary()}")
+
+def _answer(question, trace):
+    # 相似問題且初篩候選相同 → 沿用上次的答案
+    # （走關鍵字快速路徑時沒有 embedding，改以問題文字完全比對）
+    # 初篩、rerank 與取段落向量都在同一次持有 index_lock 時完成（期間 faq.txt 重建不會換掉索引）
+    with index_lock:
+        first_stage = search_similar_embedding(question, top_k=CANDIDATES, trace=trace)
+        candidates = first_stage[0]
+        q_emb = embed_query.get(question)
+        cached = answer_cache.lookup(q_emb, candidates, query=question)
+        trace.count("answer_cache_hits", cached is not None)
+        if cached is not None:
+            if trace.info:
+                print(f"\n♻️ [Cache] 使用相似問題的答案（命中率 {answer_cache.hit_rate:.0%}）")
+            print("\n🤖 Gemini 回覆：")
+            print(cached)
+            return cached
+
+        # 使用 Reranker 檢索（沿用上面的初篩結果，不再搜尋一次）
+        context_list = search_with_rerank(question, top_k=3, trace=trace, first_stage=first_stage)
+        # 去掉近似重複的段落、以 MMR 挑選並控制在 token 預算內
+        chunk_embs = embeddings[[doc_pos[c] for c in context_list]]
+    with trace.stage("pack"):
+        # 不給 query embedding → 以 rerank 排名當相關度（rerank 第一名一定最先選入，[資料來源1] 仍是它）
+        context_list, pack_stats = packer.pack(None, context_list, chunk_embs)
+    if trace.info and pack_stats["tokens_saved"]:
+        print(f"\n✂️ [Context] 省下約 {pack_stats['tokens_saved']} 個 prompt token"
+              f"（重複 {pack_stats['dropped_duplicates']}、超出預算 {pack_stats['dropped_budget']} 段）")
+    context = format_context(context_list)
     
     # === 生成答案 ===
     prompt = f"""
@@ -146,10 +238,36 @@ if __name__ == "__main__":
 {question}
 """
     
-    print("\n💬 正在生成答案...")
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    response = model.generate_content(prompt, generation_config={"temperature": 0.2})
-    
+    # 串流輸出：邊生成邊印，並記錄首字延遲
+    if trace.debug:
+        print("\n💬 正在生成答案...")
     print("\n🤖 Gemini 回覆：")
-    print(response.text)
-    print("\n" + "="*60)
\ No newline at end of file
+    answer, timing = stream_generate(model, prompt, generation_config={"temperature": 0.2})
+    trace.stages["generation"] = timing["total"]
+    trace.meta["ttft_ms"] = timing["ttft"] * 1000
+    trace.count("generate_calls")
+    trace.count("prompt_tokens", estimate_tokens(prompt))
+    trace.count("output_tokens", estimate_tokens(answer))
+    if trace.info:
+        print(f"\n\n⏱️ 首字延遲 {timing['ttft']:.2f}s，總生成時間 {timing['total']:.2f}s")
+    answer_cache.store(q_emb, candidates, answer, query=question)
+    return answer
+
+
+# === 主程式 ===
+if __name__ == "__main__":
+    # 加上 --watch 參數時，faq.txt 一改就自動重新索引，不必重啟
+    if "--watch" in sys.argv:
+        indexer.watch("faq.txt", on_faq_change)
+
+    while True:
+        question = input("\n請輸入問題（輸入 exit 離開、stats 看統計）：").strip()
+        if question.lower() in ["exit", "quit"]:
+            break
+        if question.lower() == "stats":
+            print(json.dumps({**metrics.summary(), "rerank_cascade": cascade.stats()},
+                             ensure_ascii=False, indent=2))
+            continue
+
+        answer_question(question)
+        print("\n" + "="*60)
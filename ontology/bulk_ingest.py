@@ -0,0 +1,182 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+from ontology_store import get_store
+
+# === 大量事件匯入 ===
+# 讀 CSV 或 JSONL（一行一個事件），逐行驗證後每 batch_size 筆一次交給 OntologyStore.apply_events：
+# 一次取鎖、一次寫入事件記錄，不重寫 ontology.yaml。驗證失敗或無法套用的列會記下列號與原因。
+#
+# 欄位：event, plate, type, license_status, owner, note
+#   event = add_vehicle    → plate, type 必填；license_status 預設 valid；owner 可省略
+#   event = update_license → plate, license_status 必填
+#   event = add_owner      → owner 必填；note 可省略
+#
+#   python bulk_ingest.py events.csv --errors errors.csv --compact
+
+LICENSE_STATUSES = {"valid", "expired"}
+
+# apply_events 回傳 False 時的原因
+REJECTED = {
+    "add_vehicle": "車牌已存在",
+    "update_vehicle": "找不到車牌",
+    "add_owner": "車主已存在",
+}
+
+
+def read_rows(path, fmt=None):
+    """yield (列號, dict)；fmt 為 csv / jsonl，未指定時依副檔名判斷（"-" 代表 stdin）"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            # 第 1 列是標題
+            for row_no, row in enumerate(csv.DictReader(f), 2):
+                yield row_no, row
+        else:
+            for row_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_no, {"_error": f"JSON 格式錯誤：{e.msg}"}
+                    continue
+                if not isinstance(row, dict):
+                    row = {"_error": f"每一行必須是 JSON 物件，而不是 {type(row).__name__}"}
+                yield row_no, row
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _field(row, name):
+    """欄位值（去掉前後空白）；有值但不是字串（例如 JSON 的陣列、數字）時丟出 ValueError"""
+    value = row.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{name} 必須是字串，而不是 {type(value).__name__}")
+    return value.strip()
+
+
+def to_event(row):
+    """把一列資料轉成 OntologyStore 的事件；資料不合法時丟出 ValueError"""
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    kind = _field(row, "event")
+    plate = _field(row, "plate")
+    status = _field(row, "license_status")
+    owner = _field(row, "owner")
+
+    if kind in ("add_vehicle", "update_license") and not plate:
+        raise ValueError("缺少 plate")
+    if status and status not in LICENSE_STATUSES:
+        raise ValueError(f"license_status 必須是 {'/'.join(sorted(LICENSE_STATUSES))}：{status!r}")
+
+    if kind == "add_vehicle":
+        vehicle_type = _field(row, "type")
+        if not vehicle_type:
+            raise ValueError("缺少 type")
+        fields = {"type": vehicle_type, "license_status": status or "valid"}
+        if owner:
+            fields["owner"] = owner
+        return {"op": "add_vehicle", "plate": plate, "fields": fields}
+    if kind == "update_license":
+        if not status:
+            raise ValueError("缺少 license_status")
+        return {"op": "update_vehicle", "plate": plate, "changes": {"license_status": status}}
+    if kind == "add_owner":
+        if not owner:
+            raise ValueError("缺少 owner")
+        return {"op": "add_owner", "owner": owner, "fields": {"note": _field(row, "note") or "bulk import"}}
+    raise ValueError(f"未知的 event：{kind!r}")
+
+
+def ingest(store, rows, batch_size=10_000, on_error=None):
+    """
+    rows 為 (列號, dict)；回傳 {"rows", "applied", "errors", "seconds"}。
+    on_error(列號, 原因, 原始資料) 會收到每一筆失敗的列。
+    """
+    stats = {"rows": 0, "applied": 0, "errors": 0}
+    start = time.perf_counter()
+
+    def fail(row_no, reason, row):
+        stats["errors"] += 1
+        if on_error is not None:
+            on_error(row_no, reason, row)
+
+    def commit(batch):
+        for (row_no, row, event), ok in zip(batch, store.apply_events([e for _, _, e in batch])):
+            if ok:
+                stats["applied"] += 1
+            else:
+                fail(row_no, REJECTED[event["op"]], row)
+
+    batch = []
+    for row_no, row in rows:
+        stats["rows"] += 1
+        try:
+            batch.append((row_no, row, to_event(row)))
+        except ValueError as e:
+            fail(row_no, str(e), row)
+            continue
+        if len(batch) >= batch_size:
+            commit(batch)
+            batch = []
+    if batch:
+        commit(batch)
+    store.flush()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def ingest_file(store, path, fmt=None, batch_size=10_000, errors_path=None, show_errors=10):
+    """匯入檔案並印出摘要；errors_path 有給時把所有失敗的列寫成 CSV"""
+    shown = 0
+    report_file = open(errors_path, "w", encoding="utf-8", newline="") if errors_path else None
+    report = csv.writer(report_file) if report_file else None
+    if report is not None:
+        report.writerow(["row", "error", "data"])
+
+    def on_error(row_no, reason, row):
+        nonlocal shown
+        if report is not None:
+            report.writerow([row_no, reason, json.dumps(row, ensure_ascii=False)])
+        if shown < show_errors:
+            print(f"  ❌ 第 {row_no} 列：{reason}")
+            shown += 1
+
+    try:
+        stats = ingest(store, read_rows(path, fmt), batch_size, on_error)
+    finally:
+        if report_file is not None:
+            report_file.close()
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"📥 匯入 {stats['rows']} 列：成功 {stats['applied']}、失敗 {stats['errors']}"
+          f"（{stats['seconds']:.2f}s，{rate:.0f} 列/秒）")
+    if stats["errors"] > shown:
+        print(f"  … 其餘 {stats['errors'] - shown} 筆錯誤" + (f"，見 {errors_path}" if errors_path else ""))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="大量匯入 ontology 事件（CSV / JSONL）")
+    parser.add_argument("path", help="事件檔案，- 代表 stdin")
+    parser.add_argument("--ontology", default="ontology.yaml")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--errors", default=None, help="把失敗的列寫到這個 CSV")
+    parser.add_argument("--compact", action="store_true", help="匯入後把事件記錄合併回 ontology.yaml")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.ontology):
+        sys.exit(f"❌ 找不到 {args.ontology}")
+    store = get_store(args.ontology)
+    ingest_file(store, args.path, args.format, args.batch_size, args.errors)
+    if args.compact:
+        print(f"🗜️ 已合併 {store.compact()} bytes 的事件記錄")
@@ -1,46 +1,46 @@
 # event_input.py
-import yaml
+import os
+import sys
+from ontology_store import get_store
+from bulk_ingest import ingest_file
 
 ONTOLOGY_PATH = "ontology.yaml"
-
-# --- 讀取 ontology ---
-def load_ontology():
-    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
-
-# --- 儲存 ontology ---
-def save_ontology(data):
-    with open(ONTOLOGY_PATH, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+# 透過共用的 OntologyStore 寫入：事件附加到 ontology.events.jsonl，不必重寫整份 YAML
+ontology_store = get_store(ONTOLOGY_PATH)
 
 # --- 新增車輛 ---
 def add_vehicle(plate_number, vehicle_type, license_status="valid"):
-    ontology = load_ontology()
-    if plate_number in ontology["vehicles"]:
-        print(f"⚠️ 車牌 {plate_number} 已存在。")
-        return
-    ontology["vehicles"][plate_number] = {
+    added = ontology_store.add_vehicle(plate_number, {
         "type": vehicle_type,             # ✅ 改成 type
         "license_status": license_status
-    }
-    save_ontology(ontology)
+    })
+    if not added:
+        print(f"⚠️ 車牌 {plate_number} 已存在。")
+        return
     print(f"✅ 已新增車輛 {plate_number}。")
 
 # --- 更新牌照狀態 ---
 def update_license(plate_number, new_status):
-    ontology = load_ontology()
-    if plate_number not in ontology["vehicles"]:
+    if not ontology_store.update_vehicle(plate_number, license_status=new_status):
         print(f"❌ 找不到車牌 {plate_number}。")
         return
-    ontology["vehicles"][plate_number]["license_status"] = new_status
-    save_ontology(ontology)
     print(f"🔄 已將 {plate_number} 狀態更新為：{new_status}")
 
+# --- 把事件記錄合併回快照（ontology.yaml 或 ontology.db）---
+def compact_events():
+    merged = ontology_store.compact()
+    print(f"🗜️ 已合併 {merged} bytes 的事件記錄到 {os.path.basename(ontology_store.path)}。")
+
 # --- 主程式互動 ---
 if __name__ == "__main__":
+    # 大量匯入：python event_input.py --bulk events.csv [errors.csv]（或 .jsonl），每批一次寫入
+    if len(sys.argv) >= 3 and sys.argv[1] == "--bulk":
+        ingest_file(ontology_store, sys.argv[2], errors_path=sys.argv[3] if len(sys.argv) > 3 else None)
+        sys.exit()
+
     print("🚗 Ontology Event Input 模擬器")
-    print("選擇操作：1. 新增車輛  2. 更新牌照狀態")
-    choice = input("請輸入 1 或 2：")
+    print("選擇操作：1. 新增車輛  2. 更新牌照狀態  3. 合併事件記錄")
+    choice = input("請輸入 1、2 或 3：")
 
     if choice == "1":
         plate = input("輸入車牌號碼：")
@@ -51,5 +51,7 @@ if __name__ == "__main__":
         plate = input("輸入車牌號碼：")
         status = input("輸入新狀態 (valid/expired)：")
         update_license(plate, status)
+    elif choice == "3":
+        compact_events()
     else:
         print("❌ 無效選項。")
@@ -1,8 +1,8 @@
 # ontology_agent.py
 import os
-import yaml
 import google.generativeai as genai
 from dotenv import load_dotenv
+from ontology_store import get_store
 
 # --- 初始化 ---
 load_dotenv()
@@ -10,11 +10,12 @@ genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 MODEL = genai.GenerativeModel("gemini-2.5-flash")
 ONTOLOGY_PATH = "ontology.yaml"
+ontology_store = get_store(ONTOLOGY_PATH)
 
 # --- 載入 ontology ---
 def load_ontology():
-    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    """檔案沒變就直接回傳已解析的資料（唯讀，請勿修改）"""
+    return ontology_store.get()
 
 # --- 查詢 ontology（第二層）---
 def query_ontology(plate):
@@ -28,6 +29,8 @@ def query_ontology(plate):
         f"({plate}, license_status, {vehicle['license_status']})",
         f"({plate}, type, {vehicle['type']})"
     ]
+    # 規則引擎已判定的違規（rules 區塊中有 when 條件的規則）
+    facts += [f"({plate}, violates, {rule})" for rule in ontology_store.facts.violations(plate)]
     return {"found": True, "facts": facts}
 
 # --- LLM 推理（第三層）---
@@ -1,19 +1,20 @@
 import os
-import yaml
 from dotenv import load_dotenv
 import google.generativeai as genai
 from google.generativeai.types import Tool, FunctionDeclaration
+from ontology_store import get_store
 
 # --- 初始化 ---
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 ONTOLOGY_PATH = "ontology.yaml"
+ontology_store = get_store(ONTOLOGY_PATH)
 
 # --- 查 ontology ---
 def load_ontology():
-    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    """檔案沒變就直接回傳已解析的資料（唯讀，請勿修改）"""
+    return ontology_store.get()
 
 def query_ontology(plate: str):
     """查詢 ontology.yaml 中的車輛資料"""
@@ -25,6 +26,8 @@ def query_ontology(plate: str):
     facts = [f"({plate}, license_status, {v.get('license_status', 'unknown')})"]
     if "type" in v:
         facts.append(f"({plate}, type, {v['type']})")
+    # 規則引擎已判定的違規（rules 區塊中有 when 條件的規則）
+    facts += [f"({plate}, violates, {rule})" for rule in ontology_store.facts.violations(plate)]
     return {"found": True, "facts": facts}
 
 
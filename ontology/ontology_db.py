@@ -0,0 +1,384 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from io import StringIO
+from collections.abc import Mapping
+
+# === SQLite 快照格式（ontology.db）===
+# 與 ontology.yaml 內容相同，但不必整份解析：開檔只讀 rules 等小區塊，
+# 車輛 / 車主在查詢時才以主鍵讀出單筆，啟動時間與記憶體不隨車隊大小增加。
+#   vehicles(plate, type, license_status, owner, extra)   extra = 其餘欄位（JSON）
+#   owners(name, fields)                                   fields = JSON
+#   sections(name, value)                                  rules 等其他頂層區塊（JSON）
+# vehicles 在 (owner, license_status) 與 license_status 上有索引，車主 / 狀態查詢不必掃描全表。
+#
+# OntologyStore 的快照路徑以 .db 結尾時使用本格式；事件記錄（ontology.events.jsonl）的用法不變。
+# 轉換（會先套用尚未合併的事件記錄）：
+#   python ontology_db.py to-db ontology.yaml ontology.db
+#   python ontology_db.py to-yaml ontology.db ontology.yaml
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vehicles (
+    plate TEXT PRIMARY KEY,
+    type TEXT,
+    license_status TEXT,
+    owner TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_vehicles_owner ON vehicles(owner, license_status);
+CREATE INDEX IF NOT EXISTS idx_vehicles_status ON vehicles(license_status);
+CREATE TABLE IF NOT EXISTS owners (
+    name TEXT PRIMARY KEY,
+    fields TEXT
+);
+CREATE TABLE IF NOT EXISTS sections (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+VEHICLE_COLUMNS = ("type", "license_status", "owner")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _encode_vehicle(plate, v):
+    fields = dict(v)
+    columns = [fields.pop(c, None) for c in VEHICLE_COLUMNS]
+    return (plate, *columns, _dumps(fields) if fields else None)
+
+
+def _decode_vehicle(row):
+    _, *columns, extra = row
+    v = {c: value for c, value in zip(VEHICLE_COLUMNS, columns) if value is not None}
+    if extra:
+        v.update(json.loads(extra))
+    return v
+
+
+def _encode_owner(name, fields):
+    return (name, _dumps(fields) if fields else None)
+
+
+def _decode_owner(row):
+    return json.loads(row[1]) if row[1] else {}
+
+
+# 表名 → (主鍵, 欄位, encode, decode)
+TABLES = {
+    "vehicles": ("plate", "plate, type, license_status, owner, extra", _encode_vehicle, _decode_vehicle),
+    "owners": ("name", "name, fields", _encode_owner, _decode_owner),
+}
+
+
+class OntologyDB:
+    """一個 ontology.db 連線；多個執行緒共用（以鎖保護）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+    @classmethod
+    def create(cls, path, data):
+        """把 ontology dict（vehicles / owners / rules …）寫成新的資料庫；先寫暫存檔再換上"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.executescript(SCHEMA)
+            for table, (_, columns, encode, _) in TABLES.items():
+                rows = (encode(k, v) for k, v in (data.get(table) or {}).items())
+                conn.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({','.join('?' * len(columns.split(',')))})", rows)
+            conn.executemany("INSERT INTO sections (name, value) VALUES (?, ?)",
+                             [(k, _dumps(v)) for k, v in data.items() if k not in TABLES])
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+        return cls(path)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- 單筆查詢 ---
+    def get(self, table, key):
+        pk, columns, _, decode = TABLES[table]
+        rows = self._query(f"SELECT {columns} FROM {table} WHERE {pk} = ?", (key,))
+        return decode(rows[0]) if rows else None
+
+    def exists(self, table, key):
+        pk = TABLES[table][0]
+        return bool(self._query(f"SELECT 1 FROM {table} WHERE {pk} = ?", (key,)))
+
+    def count(self, table):
+        return self._query(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+    def rows(self, table, batch=10_000):
+        """逐批讀出整張表（不會一次載入全部）：yield (主鍵, dict)"""
+        pk, columns, _, decode = TABLES[table]
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute(f"SELECT {columns} FROM {table} ORDER BY rowid")
+        while True:
+            with self._lock:
+                chunk = cur.fetchmany(batch)
+            if not chunk:
+                return
+            for row in chunk:
+                yield row[0], decode(row)
+
+    def sections(self):
+        return {name: json.loads(value) for name, value in self._query("SELECT name, value FROM sections ORDER BY rowid")}
+
+    # --- 索引查詢 ---
+    def plates_where(self, column, value):
+        return [row[0] for row in self._query(f"SELECT plate FROM vehicles WHERE {column} = ?", (value,))]
+
+    def expired_count(self, owner):
+        return self._query("SELECT COUNT(*) FROM vehicles WHERE owner = ? AND license_status = 'expired'",
+                           (owner,))[0][0]
+
+    # --- 規則查詢（rule_engine.DBRuleFacts 使用）---
+    # 欄位值與 rule_engine 一樣以字串比較，空字串代表沒有值（NULL）。
+    # 獨立欄位直接比較原始欄位（TEXT 欄位存的就是字串），才用得到 (owner, license_status) 等索引；
+    # 其餘欄位從 extra 的 JSON 取出（沒有索引）。
+    @staticmethod
+    def _field_sql(field):
+        if field in VEHICLE_COLUMNS:
+            return field, []
+        return "CAST(json_extract(extra, ?) AS TEXT)", [f'$."{field}"']
+
+    def _in_sql(self, field, values):
+        """field 的值在 values 中 → (條件, 參數)；values 含空字串時另外以 IS NULL 比對"""
+        column, column_params = self._field_sql(field)
+        present = [v for v in values if v != ""]
+        clauses, params = [], []
+        if present:
+            clauses.append(f"{column} IN ({','.join('?' * len(present))})")
+            params += column_params + present
+        if len(present) < len(values):
+            clauses.append(f"{column} IS NULL OR {column} = ''")
+            params += column_params * 2
+        return f"({' OR '.join(clauses)})", params
+
+    def _when_sql(self, when):
+        """when = {欄位: [字串值]} → (WHERE 條件, 參數)"""
+        clauses, params = [], []
+        for field, values in when.items():
+            clause, clause_params = self._in_sql(field, values)
+            clauses.append(clause)
+            params += clause_params
+        return " AND ".join(clauses), params
+
+    def plates_matching(self, when):
+        where, params = self._when_sql(when)
+        return [row[0] for row in self._query(f"SELECT plate FROM vehicles WHERE {where}", params)]
+
+    def group_count(self, when, group_by, key):
+        """符合 when 且 group_by 欄位為 key（非空）的車輛數"""
+        where, params = self._when_sql(when)
+        column, column_params = self._field_sql(group_by)
+        return self._query(f"SELECT COUNT(*) FROM vehicles WHERE {column} = ? AND {where}",
+                           column_params + [key] + params)[0][0]
+
+    def group_counts(self, when, group_by, min_count=1):
+        """[(分組值, 符合 when 的車輛數), ...]，只回傳至少 min_count 台的分組（空值不算）"""
+        where, params = self._when_sql(when)
+        column, column_params = self._field_sql(group_by)
+        return self._query(
+            f"SELECT {column} AS g, COUNT(*) FROM vehicles WHERE {where}"
+            f" GROUP BY g HAVING g IS NOT NULL AND g != '' AND COUNT(*) >= ?",
+            column_params + params + [min_count])
+
+    # --- 寫入 ---
+    def merge(self, changes):
+        """changes = {表名: {主鍵: dict}}；在同一個交易中新增或覆蓋"""
+        with self._lock:
+            with self._conn:
+                for table, items in changes.items():
+                    pk, columns, encode, _ = TABLES[table]
+                    names = [c.strip() for c in columns.split(",")]
+                    # upsert 保留原本的 rowid：轉回 YAML 時順序不變
+                    self._conn.executemany(
+                        f"INSERT INTO {table} ({columns}) VALUES ({','.join('?' * len(names))})"
+                        f" ON CONFLICT({pk}) DO UPDATE SET "
+                        + ", ".join(f"{c} = excluded.{c}" for c in names[1:]),
+                        (encode(k, v) for k, v in items.items()))
+
+
+class LazyTable(Mapping):
+    """
+    資料庫中的一張表，加上記憶體中的修改（重播事件記錄的結果）。
+    用法和 dict 相同（in / [] / get / items），但只讀出用到的那幾筆。
+    """
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.changes = {}   # 主鍵 → 修改後的 dict
+        self._added = set()  # changes 中資料庫原本沒有的主鍵
+        self._count = None   # 資料庫中的筆數（快照不變，算一次就好）
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        value = self.db.get(self.table, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.changes or self.db.exists(self.table, key)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._added.add(key)
+        self.changes[key] = value
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self.db.count(self.table)
+        return self._count + len(self._added)
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def items(self):
+        for key, value in self.db.rows(self.table):
+            yield key, self.changes.get(key, value)
+        for key in self._added:
+            yield key, self.changes[key]
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+
+def load_snapshot(db):
+    """OntologyStore 的資料：vehicles / owners 為 LazyTable，其餘區塊（rules 等）直接讀出"""
+    return {**{table: LazyTable(db, table) for table in TABLES}, **db.sections()}
+
+
+class DBIndex:
+    """
+    與 OntologyIndex 介面相同：原本的資料直接用資料庫索引查，
+    事件造成的變化（新增 / 移除的車牌、expired 數量增減）記在記憶體。
+    """
+
+    def __init__(self, db, vehicles=None):
+        self.db = db
+        self._owner_added, self._owner_removed = {}, {}
+        self._status_added, self._status_removed = {}, {}
+        self._expired_delta = {}  # owner → 相對資料庫的增減
+        # 建立前已重播的事件（vehicles 為 LazyTable）：從資料庫中的原值換成修改後的值
+        for plate, v in (vehicles.changes.items() if vehicles is not None else ()):
+            old = db.get("vehicles", plate)
+            if old is not None:
+                self.remove(plate, old)
+            self.add(plate, v)
+
+    @staticmethod
+    def _move(src, dst, key, plate):
+        src.get(key, set()).discard(plate)
+        dst.setdefault(key, set()).add(plate)
+
+    def _update(self, plate, v, sign):
+        owner, status = v.get("owner"), v.get("license_status")
+        removed_added = ((self._owner_removed, self._owner_added), (self._status_removed, self._status_added))
+        for key, (removed, added) in zip((owner, status), removed_added):
+            if key is not None:
+                if sign > 0:
+                    self._move(removed, added, key, plate)
+                else:
+                    self._move(added, removed, key, plate)
+        if owner is not None and status == "expired":
+            self._expired_delta[owner] = self._expired_delta.get(owner, 0) + sign
+
+    def add(self, plate, v):
+        self._update(plate, v, 1)
+
+    def remove(self, plate, v):
+        self._update(plate, v, -1)
+
+    def _plates(self, column, key, added, removed):
+        plates = set(self.db.plates_where(column, key)) - removed.get(key, set())
+        return sorted(plates | added.get(key, set()))
+
+    def plates_of(self, owner):
+        return self._plates("owner", owner, self._owner_added, self._owner_removed)
+
+    def plates_with_status(self, status):
+        return self._plates("license_status", status, self._status_added, self._status_removed)
+
+    def expired_of(self, owner):
+        return self.db.expired_count(owner) + self._expired_delta.get(owner, 0)
+
+
+# --- 格式轉換 ---
+def yaml_to_db(yaml_path, db_path):
+    """ontology.yaml（含尚未合併的事件記錄）→ ontology.db，回傳車輛數"""
+    from ontology_store import OntologyStore
+    data = OntologyStore(yaml_path).get()
+    OntologyDB.create(db_path, data)
+    return len(data.get("vehicles") or {})
+
+
+def db_to_yaml(db_path, yaml_path, batch=10_000):
+    """ontology.db（含尚未合併的事件記錄）→ ontology.yaml，逐批輸出，不會一次載入全部車輛"""
+    from ontology_store import OntologyStore, dump_yaml
+    data = OntologyStore(db_path).get()
+    tmp = f"{yaml_path}.{os.getpid()}.tmp"
+    n = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for name, value in data.items():
+            if name not in TABLES:
+                dump_yaml({name: value}, f)
+                continue
+            if not len(value):
+                continue
+            f.write(f"{name}:\n")
+            chunk = {}
+            for key, item in value.items():
+                chunk[key] = item
+                if len(chunk) >= batch:
+                    _dump_indented(chunk, f, dump_yaml)
+                    chunk = {}
+            _dump_indented(chunk, f, dump_yaml)
+            if name == "vehicles":
+                n = len(value)
+    os.replace(tmp, yaml_path)
+    return n
+
+
+def _dump_indented(chunk, f, dump_yaml):
+    """把 {key: dict} 輸出成某個頂層區塊底下的一段（縮排兩格）"""
+    if not chunk:
+        return
+    buf = StringIO()
+    dump_yaml(chunk, buf)
+    f.writelines("  " + line for line in buf.getvalue().splitlines(keepends=True))
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="ontology.yaml ⇄ ontology.db 轉換")
+    parser.add_argument("direction", choices=["to-db", "to-yaml"])
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n = (yaml_to_db if args.direction == "to-db" else db_to_yaml)(args.src, args.dst)
+    print(f"✅ {args.src} → {args.dst}：{n} 台車輛（{time.perf_counter() - start:.2f}s）")
+    if args.direction == "to-db":
+        print("   同一資料夾有 .db 時 OntologyStore 會優先使用它；改回 YAML 請先轉回再刪除 .db")
@@ -0,0 +1,465 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+import yaml
+
+from ontology_db import OntologyDB, DBIndex, load_snapshot
+from rule_engine import RuleFacts, DBRuleFacts, compile_rules
+
+# === 共用的 ontology 快取 ===
+# ontology.yaml 只在第一次使用、或檔案的 mtime / 大小改變時才重新解析，
+# 其餘時候每次查詢只多一次 os.stat。有 libyaml 時使用 C 版的 CSafeLoader（快很多）。
+# get() 回傳的是所有執行緒共用的同一份資料：請當成唯讀，要修改請用 add_vehicle / update_vehicle。
+#
+# 次要索引（OntologyIndex）：車主 → 車牌、牌照狀態 → 車牌、每位車主的 expired 車輛數。
+# 檔案被外部改寫時整份重建；透過本模組新增 / 更新車輛時只調整受影響的項目。
+#
+# 寫入路徑：append-only 事件記錄（ontology.events.jsonl，一行一個事件）
+#   - 寫入時持有檔案鎖（flock），多個 process 同時寫也不會遺失更新
+#   - 每筆事件立即寫入 OS，fsync 每 sync_every 筆或每 sync_interval 秒才做一次
+#   - 讀取 = ontology.yaml 快照 + 重播記錄；記錄變長時只重播新增的部分
+#   - 記錄超過 compact_bytes（且不小於快照）時在背景合併成新的快照並清空記錄
+#     （事件皆可重複套用，合併途中當機也不會出錯）
+#
+# 快照也可以是 SQLite（ontology.db，見 ontology_db.py）：不整份載入，車輛 / 車主查詢時才讀單筆，
+# 索引改用資料庫索引；合併時只把事件改到的資料寫回資料庫。get_store() 遇到同名的 .db 會優先使用。
+#
+# 規則（rule_engine.RuleFacts）：rules 區塊編譯成條件，推導出違規車輛、高風險車主等事實；
+# 和索引一樣在第一次使用時全量計算，之後隨事件增量更新（.db 快照改用 DBRuleFacts，不掃描全表）。
+# 高風險等判定只來自規則，索引只提供查詢。
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:  # 沒有編譯 libyaml
+    from yaml import SafeLoader, SafeDumper
+
+def parse_yaml(f):
+    return yaml.load(f, Loader=SafeLoader)
+
+
+def dump_yaml(data, f):
+    yaml.dump(data, f, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+
+
+# 事件類型 → (主鍵欄位, 內容欄位)
+EVENT_FIELDS = {
+    "add_vehicle": ("plate", "fields"),
+    "update_vehicle": ("plate", "changes"),
+    "add_owner": ("owner", "fields"),
+}
+
+
+def check_event(event):
+    """事件格式不對時丟出 ValueError"""
+    if not isinstance(event, dict) or event.get("op") not in EVENT_FIELDS:
+        raise ValueError(f"未知的事件：{event!r}")
+    key, body = EVENT_FIELDS[event["op"]]
+    if not isinstance(event.get(key), str) or not event[key]:
+        raise ValueError(f"{event['op']} 的 {key} 必須是非空字串：{event.get(key)!r}")
+    if not isinstance(event.get(body), dict):
+        raise ValueError(f"{event['op']} 的 {body} 必須是物件：{event.get(body)!r}")
+
+
+try:
+    import fcntl
+except ImportError:  # Windows：只保證同一個 process 內的執行緒互斥
+    fcntl = None
+
+
+class OntologyIndex:
+    def __init__(self, vehicles=None):
+        self.by_owner = {}       # owner → {plate}
+        self.by_status = {}      # license_status → {plate}
+        self.expired_count = {}  # owner → expired 車輛數（0 不保留）
+        for plate, v in (vehicles or {}).items():
+            self.add(plate, v)
+
+    def add(self, plate, v):
+        owner, status = v.get("owner"), v.get("license_status")
+        if owner is not None:
+            self.by_owner.setdefault(owner, set()).add(plate)
+        if status is not None:
+            self.by_status.setdefault(status, set()).add(plate)
+        if owner is not None and status == "expired":
+            self._adjust_expired(owner, 1)
+
+    def remove(self, plate, v):
+        owner, status = v.get("owner"), v.get("license_status")
+        if owner is not None:
+            self._discard(self.by_owner, owner, plate)
+        if status is not None:
+            self._discard(self.by_status, status, plate)
+        if owner is not None and status == "expired":
+            self._adjust_expired(owner, -1)
+
+    @staticmethod
+    def _discard(mapping, key, plate):
+        plates = mapping.get(key)
+        if plates is not None:
+            plates.discard(plate)
+            if not plates:
+                del mapping[key]
+
+    def _adjust_expired(self, owner, delta):
+        n = self.expired_count.get(owner, 0) + delta
+        if n > 0:
+            self.expired_count[owner] = n
+        else:
+            self.expired_count.pop(owner, None)
+
+    def plates_of(self, owner):
+        return sorted(self.by_owner.get(owner, ()))
+
+    def expired_of(self, owner):
+        return self.expired_count.get(owner, 0)
+
+    def plates_with_status(self, status):
+        return sorted(self.by_status.get(status, ()))
+
+
+class OntologyStore:
+    def __init__(self, path, log_path=None, sync_every=64, sync_interval=0.5, compact_bytes=8 << 20):
+        self.path = path
+        self.log_path = log_path or os.path.splitext(path)[0] + ".events.jsonl"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_bytes = compact_bytes
+        self.is_db = path.endswith(".db")
+        self.version = 0  # 每重新載入快照一次加 1
+        self._data = None
+        self._db = None
+        self._index = None
+        self._facts = None
+        self._snap_stat = None
+        self._log_offset = 0  # 已套用到的位置（完整的行）
+        self._log_seen = 0    # 上次看到的記錄大小（可能含寫到一半的行）
+        self._log = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._compacting = False
+        self._compact_tmp = None
+        self._compact_lock = threading.Lock()  # 同一 process 一次只做一個合併
+        self._lock = threading.RLock()
+        atexit.register(self._at_exit)
+
+    def _snapshot_stat(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _log_size(self):
+        try:
+            return os.stat(self.log_path).st_size
+        except FileNotFoundError:
+            return 0
+
+    # --- 讀取：快照 + 重播 ---
+    def get(self):
+        """回傳目前的 ontology（dict）；快照有變才重新解析，記錄有變只重播新增的事件"""
+        snap, size = self._snapshot_stat(), self._log_size()
+        if snap == self._snap_stat and size == self._log_seen:
+            return self._data
+        with self._lock, self._shared_log_lock():
+            self._refresh_locked()
+            return self._data
+
+    @contextmanager
+    def _shared_log_lock(self):
+        """讀取時持有共享鎖，不會看到合併到一半（快照已換、記錄還沒改寫）的狀態"""
+        if fcntl is None or not os.path.exists(self.log_path):
+            yield
+            return
+        with open(self.log_path, "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _refresh_locked(self):
+        snap = self._snapshot_stat()
+        # 快照被換掉或記錄被清空（compact）→ 從新快照重來
+        if snap != self._snap_stat or self._log_size() < self._log_offset:
+            if self.is_db:
+                self._db = OntologyDB(self.path)
+                self._data = load_snapshot(self._db)
+            else:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = parse_yaml(f) or {}
+            self._index = self._facts = None
+            self._log_offset = self._log_seen = 0
+            self._snap_stat = snap
+            self.version += 1
+        self._replay_locked()
+
+    def _replay_locked(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                tail = f.read()
+        except FileNotFoundError:
+            tail = b""
+        end = tail.rfind(b"\n") + 1  # 最後一行可能還在寫，先不處理
+        for line in tail[:end].splitlines():
+            if line.strip():
+                self._apply_locked(json.loads(line))
+        self._log_offset += end
+        self._log_seen = self._log_offset + len(tail) - end
+
+    def _apply_locked(self, event):
+        """套用一個事件並同步更新索引與規則事實；事件不成立（重複新增、找不到車牌）時回傳 False"""
+        op = event["op"]
+        if op == "add_vehicle":
+            vehicles = self._data.setdefault("vehicles", {})
+            if event["plate"] in vehicles:
+                return False
+            vehicles[event["plate"]] = v = dict(event["fields"])
+            for derived in self._derived():
+                derived.add(event["plate"], v)
+        elif op == "update_vehicle":
+            vehicles = self._data.get("vehicles") or {}
+            v = vehicles.get(event["plate"])
+            if v is None:
+                return False
+            # 換成新的 dict（.db 快照讀出的是副本，原地修改不會留下來）
+            new = {**v, **event["changes"]}
+            vehicles[event["plate"]] = new
+            for derived in self._derived():
+                derived.remove(event["plate"], v)
+                derived.add(event["plate"], new)
+        elif op == "add_owner":
+            owners = self._data.setdefault("owners", {})
+            if event["owner"] in owners:
+                return False
+            owners[event["owner"]] = dict(event["fields"])
+        else:
+            raise ValueError(f"未知的事件類型：{op}")
+        return True
+
+    def _derived(self):
+        """已建立、需要隨事件更新的衍生資料（索引、規則事實）"""
+        return [d for d in (self._index, self._facts) if d is not None]
+
+    @property
+    def index(self):
+        """目前資料的次要索引（重新載入快照後第一次使用時建立）"""
+        self.get()
+        with self._lock:
+            if self._index is None:
+                self._index = (DBIndex(self._db, self._data["vehicles"]) if self.is_db
+                               else OntologyIndex(self._data.get("vehicles") or {}))
+            return self._index
+
+    @property
+    def facts(self):
+        """rules 區塊推導出的事實（RuleFacts / DBRuleFacts）；重新載入快照後第一次使用時建立"""
+        self.get()
+        with self._lock:
+            if self._facts is None:
+                self._facts = (DBRuleFacts(self._db, *compile_rules(self._data.get("rules")), self._data["vehicles"])
+                               if self.is_db else RuleFacts.from_ontology(self._data))
+            return self._facts
+
+    # --- 寫入：附加到事件記錄 ---
+    def _locked_log(self):
+        """取得 process 內與跨 process 的寫入鎖（呼叫端需已持有 self._lock）"""
+        if self._log is None:
+            self._log = open(self.log_path, "ab")
+        if fcntl is not None:
+            fcntl.flock(self._log.fileno(), fcntl.LOCK_EX)
+        return self._log
+
+    def _unlock_log(self):
+        if fcntl is not None:
+            fcntl.flock(self._log.fileno(), fcntl.LOCK_UN)
+
+    def apply_events(self, events):
+        """
+        依序套用並寫入多個事件（一次取鎖、一次寫入），回傳每個事件是否成立。
+        事件格式：{"op": "add_vehicle", "plate", "fields"} / {"op": "update_vehicle", "plate", "changes"}
+                  / {"op": "add_owner", "owner", "fields"}
+        整批先檢查格式並轉成 JSON，有任何一筆不合法就丟出 ValueError，資料與記錄都不會改動。
+        """
+        events = list(events)
+        ts = time.time()
+        encoded = []
+        for event in events:
+            check_event(event)
+            try:
+                encoded.append(json.dumps({**event, "ts": ts}, ensure_ascii=False) + "\n")
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"事件無法寫成 JSON：{e}") from None
+        with self._lock:
+            log = self._locked_log()
+            try:
+                self._refresh_locked()
+                if self._log_seen > self._log_offset:
+                    # 其他寫入者寫到一半就中斷，留下不完整的行：截掉再接著寫
+                    os.truncate(self.log_path, self._log_offset)
+                    self._log_seen = self._log_offset
+                results, lines = [], []
+                for event, line in zip(events, encoded):
+                    ok = self._apply_locked(event)
+                    results.append(ok)
+                    if ok:
+                        lines.append(line)
+                if lines:
+                    payload = "".join(lines).encode("utf-8")
+                    log.write(payload)
+                    log.flush()
+                    self._log_offset += len(payload)
+                    self._log_seen = self._log_offset
+                    self._unsynced += len(lines)
+                    if (self._unsynced >= self.sync_every
+                            or time.monotonic() - self._last_sync >= self.sync_interval):
+                        self._sync_locked()
+            finally:
+                self._unlock_log()
+            if self._log_offset >= self._compact_threshold() and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._background_compact, daemon=True).start()
+        return results
+
+    def _compact_threshold(self):
+        if self.is_db:
+            # 合併 .db 只寫回改到的資料，成本與記錄大小成正比
+            return self.compact_bytes
+        # 記錄至少和快照一樣大才合併 YAML：每次合併的成本由之前的寫入分攤，不會越寫越慢
+        return max(self.compact_bytes, self._snap_stat[1])
+
+    def _sync_locked(self):
+        if self._log is not None and self._unsynced:
+            os.fsync(self._log.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def flush(self):
+        """把尚未 fsync 的事件寫到磁碟（程式結束時會自動呼叫）"""
+        with self._lock:
+            self._sync_locked()
+
+    def add_vehicle(self, plate, fields):
+        """新增車輛；車牌已存在時回傳 False"""
+        return self.apply_events([{"op": "add_vehicle", "plate": plate, "fields": dict(fields)}])[0]
+
+    def update_vehicle(self, plate, **changes):
+        """更新車輛欄位；找不到車牌時回傳 False"""
+        return self.apply_events([{"op": "update_vehicle", "plate": plate, "changes": changes}])[0]
+
+    def add_owner(self, owner, fields):
+        """新增車主資料；已存在時回傳 False"""
+        return self.apply_events([{"op": "add_owner", "owner": owner, "fields": dict(fields)}])[0]
+
+    # --- 合併：快照 + 記錄 → 新快照 ---
+    def compact(self):
+        """
+        把目前狀態寫成新的 ontology.yaml，並從事件記錄移除已寫入快照的部分，回傳合併掉的 bytes。
+        只在複製資料與改寫記錄時持有鎖；最花時間的 YAML 輸出不擋住寫入。
+        """
+        with self._compact_lock:
+            return self._compact_db() if self.is_db else self._compact()
+
+    def _compact_db(self):
+        with self._lock:
+            log = self._locked_log()
+            try:
+                self._refresh_locked()
+                merged = self._log_offset
+                if not merged:
+                    return 0
+                self._db.merge({name: self._data[name].changes for name in ("vehicles", "owners")})
+                self._rewrite_log_locked(log, merged)
+                # 改到的資料已在資料庫裡：下次讀取重新開啟，只重播合併後才寫入的事件
+                self._snap_stat = None
+                return merged
+            finally:
+                self._unlock_log()
+
+    def _compact(self):
+        with self._lock:
+            self._refresh_locked()
+            merged = self._log_offset
+            if not merged:
+                return 0
+            snap = self._snap_stat
+            # 事件只會改到第二層（車輛 / 車主的欄位），複製到這一層就夠了
+            data = {
+                section: ({k: dict(v) if isinstance(v, dict) else v for k, v in value.items()}
+                          if isinstance(value, dict) else value)
+                for section, value in self._data.items()
+            }
+
+        tmp = self._compact_tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                dump_yaml(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp)
+            self._compact_tmp = None
+            raise
+
+        with self._lock:
+            log = self._locked_log()
+            try:
+                if self._snapshot_stat() != snap:
+                    # 其他 process 已經合併過
+                    os.remove(tmp)
+                    return 0
+                self._refresh_locked()
+                # 先換快照再改寫記錄：中途當機時已合併的事件會被重播一次，結果相同
+                os.replace(tmp, self.path)
+                self._rewrite_log_locked(log, merged)
+                self._snap_stat = self._snapshot_stat()
+                self._log_offset -= merged
+                self._log_seen -= merged
+                return merged
+            finally:
+                self._compact_tmp = None
+                self._unlock_log()
+
+    def _rewrite_log_locked(self, log, merged):
+        """從記錄移除前 merged bytes（已寫入快照的事件）"""
+        with open(self.log_path, "rb") as f:
+            f.seek(merged)
+            tail = f.read()
+        # 原地改寫（不換檔案），其他 process 開著的 append handle 仍然有效
+        os.ftruncate(log.fileno(), 0)
+        log.write(tail)
+        log.flush()
+        os.fsync(log.fileno())
+        self._unsynced = 0
+
+    def _at_exit(self):
+        self.flush()
+        # 背景合併還沒做完就結束：丟掉寫到一半的快照，記錄仍完整，下次再合併
+        if self._compact_tmp and os.path.exists(self._compact_tmp):
+            os.remove(self._compact_tmp)
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path="ontology.yaml"):
+    """
+    同一個檔案（絕對路徑）在整個 process 內共用一個 OntologyStore。
+    給 ontology.yaml 但同一資料夾有 ontology.db（python ontology_db.py to-db 產生）時改用 .db。
+    """
+    path = os.path.abspath(path)
+    db_path = os.path.splitext(path)[0] + ".db"
+    if path != db_path and os.path.exists(db_path):
+        path = db_path
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = OntologyStore(path)
+        return _stores[path]
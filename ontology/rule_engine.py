@@ -0,0 +1,255 @@
+import numpy as np
+
+# === 宣告式規則引擎 ===
+# ontology.yaml 的 rules 區塊除了給 LLM 看的 description，也可以寫成可執行的條件：
+#
+#   rules:
+#     expired_license:              # 車輛規則：when 的每個欄位都符合（值或值的清單）→ 違規
+#       description: ...
+#       when:
+#         license_status: expired
+#     high_risk_owner:              # 計數規則：依 group_by（預設 owner）分組，
+#       description: ...            # 符合 count 指定的車輛規則達 at_least 台 → 成立
+#       count: expired_license
+#       at_least: 2
+#
+# 只有 description 的規則不會被編譯（仍交給 LLM 判斷）。
+# RuleFacts：第一次使用時以 numpy 對整個車隊分批向量化計算，之後隨事件增量更新
+# （介面與 OntologyIndex 相同：add / remove），查詢時不必再問 LLM。
+# DBRuleFacts：.db 快照用，介面與 RuleFacts 相同但不掃描全表——單台車直接判斷，
+# 車輛清單與計數交給 SQL（見 OntologyDB 的規則查詢），事件造成的變化記在記憶體。
+
+
+def _text(value):
+    """欄位值統一轉成字串比較（None → 空字串）"""
+    return "" if value is None else str(value)
+
+
+class VehicleRule:
+    def __init__(self, name, description, when):
+        self.name = name
+        self.description = description
+        self.when = {field: [_text(x) for x in (values if isinstance(values, list) else [values])]
+                     for field, values in when.items()}
+
+    def matches(self, v):
+        return all(_text(v.get(field)) in values for field, values in self.when.items())
+
+    def mask(self, columns):
+        """columns = {欄位: 字串陣列}，回傳每台車是否符合"""
+        return np.logical_and.reduce([np.isin(columns[field], values) for field, values in self.when.items()])
+
+    def explain(self):
+        """由條件產生的說明（不依賴手寫的 description）"""
+        conditions = "且".join(f"{field} 為 {' 或 '.join(v or '（空）' for v in values)}"
+                              for field, values in self.when.items())
+        return f"{conditions} 的車輛符合 {self.name}"
+
+
+class CountRule:
+    def __init__(self, name, description, count, at_least, group_by="owner"):
+        self.name = name
+        self.description = description
+        self.count = count
+        self.at_least = at_least
+        self.group_by = group_by
+
+    def explain(self):
+        """由條件產生的說明（門檻直接取自 at_least）"""
+        return f"同一個 {self.group_by} 有 {self.at_least} 台以上符合 {self.count} 的車輛 → {self.name} 成立"
+
+
+def compile_rules(rules):
+    """rules 區塊 → (車輛規則, 計數規則)；條件寫錯時丟出 ValueError"""
+    vehicle_rules, count_rules = {}, []
+    for name, spec in (rules or {}).items():
+        spec = spec or {}
+        description = spec.get("description", "")
+        if "when" in spec:
+            if not isinstance(spec["when"], dict) or not spec["when"]:
+                raise ValueError(f"規則 {name}：when 必須是「欄位: 值」的對應")
+            vehicle_rules[name] = VehicleRule(name, description, spec["when"])
+        elif "count" in spec:
+            at_least = spec.get("at_least", 1)
+            if not isinstance(at_least, int) or at_least < 1:
+                raise ValueError(f"規則 {name}：at_least 必須是正整數")
+            count_rules.append(CountRule(name, description, spec["count"], at_least, spec.get("group_by", "owner")))
+    for rule in count_rules:
+        if rule.count not in vehicle_rules:
+            raise ValueError(f"規則 {rule.name}：count 必須指向有 when 條件的車輛規則，而不是 {rule.count!r}")
+    return list(vehicle_rules.values()), count_rules
+
+
+class RuleFacts:
+    """
+    規則推導出的事實：
+      vehicles[規則] = 符合的車牌集合
+      counts[規則]   = {分組值: 符合的車輛數}（0 不保留）
+      groups[規則]   = 達到 at_least 的分組值集合（例如高風險車主）
+    """
+
+    def __init__(self, vehicle_rules, count_rules, vehicles=None, chunk=65_536):
+        self.vehicle_rules = vehicle_rules
+        self.count_rules = count_rules
+        self.vehicles = {r.name: set() for r in vehicle_rules}
+        self.counts = {r.name: {} for r in count_rules}
+        self.groups = {r.name: set() for r in count_rules}
+        self.rules = {r.name: r for r in [*vehicle_rules, *count_rules]}
+        if vehicles:
+            self.evaluate(vehicles, chunk)
+
+    @classmethod
+    def from_ontology(cls, data):
+        return cls(*compile_rules(data.get("rules")), data.get("vehicles") or {})
+
+    # --- 全量計算（向量化）---
+    def evaluate(self, vehicles, chunk=65_536):
+        """vehicles 為 {車牌: dict}（dict 或 LazyTable）；分批取出欄位成陣列後一次判斷整批"""
+        fields = sorted({f for r in self.vehicle_rules for f in r.when} | {r.group_by for r in self.count_rules})
+        plates, values = [], []
+        for plate, v in vehicles.items():
+            plates.append(plate)
+            values.append(v)
+            if len(plates) >= chunk:
+                self._evaluate_chunk(plates, values, fields)
+                plates, values = [], []
+        if plates:
+            self._evaluate_chunk(plates, values, fields)
+        for rule in self.count_rules:
+            self.groups[rule.name] = {k for k, n in self.counts[rule.name].items() if n >= rule.at_least}
+
+    def _evaluate_chunk(self, plates, values, fields):
+        columns = {f: np.array([_text(v.get(f)) for v in values]) for f in fields}
+        plates = np.array(plates, dtype=object)
+        masks = {r.name: r.mask(columns) for r in self.vehicle_rules}
+        for rule in self.vehicle_rules:
+            self.vehicles[rule.name].update(plates[masks[rule.name]].tolist())
+        for rule in self.count_rules:
+            keys = columns[rule.group_by][masks[rule.count]]
+            keys, n = np.unique(keys[keys != ""], return_counts=True)
+            counts = self.counts[rule.name]
+            for key, c in zip(keys.tolist(), n.tolist()):
+                counts[key] = counts.get(key, 0) + c
+
+    # --- 增量更新（每個事件只看受影響的車輛）---
+    def add(self, plate, v):
+        self._update(plate, v, 1)
+
+    def remove(self, plate, v):
+        self._update(plate, v, -1)
+
+    def _update(self, plate, v, sign):
+        matched = {r.name for r in self.vehicle_rules if r.matches(v)}
+        for name in matched:
+            if sign > 0:
+                self.vehicles[name].add(plate)
+            else:
+                self.vehicles[name].discard(plate)
+        for rule in self.count_rules:
+            key = _text(v.get(rule.group_by))
+            if rule.count not in matched or not key:
+                continue
+            counts = self.counts[rule.name]
+            n = counts.get(key, 0) + sign
+            if n > 0:
+                counts[key] = n
+            else:
+                counts.pop(key, None)
+            if n >= rule.at_least:
+                self.groups[rule.name].add(key)
+            else:
+                self.groups[rule.name].discard(key)
+
+    # --- 查詢 ---
+    def violations(self, plate):
+        """這台車符合的車輛規則"""
+        return [r.name for r in self.vehicle_rules if plate in self.vehicles[r.name]]
+
+    def group_facts(self, key):
+        """某個分組值（例如車主）在各計數規則的結果：[(規則, 符合的車輛數, 是否成立), ...]"""
+        return [(r.name, self.counts[r.name].get(key, 0), key in self.groups[r.name]) for r in self.count_rules]
+
+    def group_counts(self, name):
+        """計數規則成立的分組值與符合的車輛數：[(分組值, 車輛數), ...]，數量多的在前"""
+        counts = self.counts[name]
+        return sorted(((k, counts[k]) for k in self.groups[name]), key=lambda x: (-x[1], x[0]))
+
+    def matching(self, name):
+        """符合某條規則的車牌（車輛規則）或分組值（計數規則），排序後回傳"""
+        return sorted(self.vehicles[name] if name in self.vehicles else self.groups[name])
+
+    def summary(self):
+        return {**{name: len(p) for name, p in self.vehicles.items()},
+                **{name: len(g) for name, g in self.groups.items()}}
+
+
+class DBRuleFacts:
+    """與 RuleFacts 相同的查詢介面；db 為 OntologyDB，vehicles 為對應的 LazyTable"""
+
+    def __init__(self, db, vehicle_rules, count_rules, vehicles):
+        self.db = db
+        self.vehicle_rules = vehicle_rules
+        self.count_rules = count_rules
+        self.rules = {r.name: r for r in [*vehicle_rules, *count_rules]}
+        self._vehicles = vehicles
+        self._added = {r.name: set() for r in vehicle_rules}    # 相對資料庫新增 / 移除的符合車牌
+        self._removed = {r.name: set() for r in vehicle_rules}
+        self._delta = {r.name: {} for r in count_rules}         # 分組值 → 相對資料庫的增減
+        # 建立前已重播的事件：從資料庫中的原值換成修改後的值
+        for plate, v in vehicles.changes.items():
+            old = db.get("vehicles", plate)
+            if old is not None:
+                self.remove(plate, old)
+            self.add(plate, v)
+
+    # --- 增量更新 ---
+    def add(self, plate, v):
+        self._update(plate, v, 1)
+
+    def remove(self, plate, v):
+        self._update(plate, v, -1)
+
+    def _update(self, plate, v, sign):
+        matched = {r.name for r in self.vehicle_rules if r.matches(v)}
+        for name in matched:
+            src, dst = (self._removed, self._added) if sign > 0 else (self._added, self._removed)
+            src[name].discard(plate)
+            dst[name].add(plate)
+        for rule in self.count_rules:
+            key = _text(v.get(rule.group_by))
+            if rule.count in matched and key:
+                delta = self._delta[rule.name]
+                delta[key] = delta.get(key, 0) + sign
+
+    def _count(self, rule, key):
+        when = self.rules[rule.count].when
+        return self.db.group_count(when, rule.group_by, key) + self._delta[rule.name].get(key, 0)
+
+    # --- 查詢 ---
+    def violations(self, plate):
+        v = self._vehicles.get(plate)
+        return [] if v is None else [r.name for r in self.vehicle_rules if r.matches(v)]
+
+    def group_facts(self, key):
+        facts = []
+        for rule in self.count_rules:
+            n = self._count(rule, key) if key else 0
+            facts.append((rule.name, n, n >= rule.at_least))
+        return facts
+
+    def group_counts(self, name):
+        rule = self.rules[name]
+        counts = dict(self.db.group_counts(self.rules[rule.count].when, rule.group_by, rule.at_least))
+        for key, d in self._delta[name].items():
+            if d:
+                counts[key] = self._count(rule, key)
+        return sorted(((k, n) for k, n in counts.items() if n >= rule.at_least), key=lambda x: (-x[1], x[0]))
+
+    def matching(self, name):
+        if name in self._added:
+            plates = set(self.db.plates_matching(self.rules[name].when)) - self._removed[name]
+            return sorted(plates | self._added[name])
+        return sorted(k for k, _ in self.group_counts(name))
+
+    def summary(self):
+        return {name: len(self.matching(name)) for name in self.rules}
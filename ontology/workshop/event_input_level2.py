@@ -1,70 +1,65 @@
-import yaml
+import os
+import sys
 
-ONTOLOGY_PATH = "ontology.yaml"
-
-# --- 讀取 ontology ---
-def load_ontology():
-    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+# 共用模組放在上一層 ontology/ 資料夾
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ontology_store import get_store
+from bulk_ingest import ingest_file
 
-# --- 儲存 ontology ---
-def save_ontology(data):
-    with open(ONTOLOGY_PATH, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+ONTOLOGY_PATH = "ontology.yaml"
+# 透過共用的 OntologyStore 寫入：事件附加到 ontology.events.jsonl（不重寫整份 YAML），
+# 同時更新記憶體中的資料與次要索引（車主 / 牌照狀態 / expired 數）
+ontology_store = get_store(ONTOLOGY_PATH)
 
 # --- 新增車輛（含車主） ---
 def add_vehicle(plate_number, vehicle_type, license_status="valid", owner="Unknown"):
-    ontology = load_ontology()
-
-    if plate_number in ontology["vehicles"]:
-        print(f"⚠️ 車牌 {plate_number} 已存在。")
-        return
-
-    ontology["vehicles"][plate_number] = {
+    added = ontology_store.add_vehicle(plate_number, {
         "type": vehicle_type,
         "license_status": license_status,
         "owner": owner
-    }
+    })
+    if not added:
+        print(f"⚠️ 車牌 {plate_number} 已存在。")
+        return
 
-    save_ontology(ontology)
     print(f"✅ 已新增車輛 {plate_number}（{vehicle_type}，狀態：{license_status}，車主：{owner}）。")
 
 # --- 更新牌照狀態 ---
 def update_license(plate_number, new_status):
-    ontology = load_ontology()
-
-    if plate_number not in ontology["vehicles"]:
+    if not ontology_store.update_vehicle(plate_number, license_status=new_status):
         print(f"❌ 找不到車牌 {plate_number}。")
         return
 
-    ontology["vehicles"][plate_number]["license_status"] = new_status
-    save_ontology(ontology)
     print(f"🔄 已將 {plate_number} 狀態更新為：{new_status}")
 
 # --- 新增或更新車主（非必要） ---
 def add_owner(owner_name):
-    ontology = load_ontology()
-
     # 這裡只是示範，可擴充 owner-specific metadata
-    if "owners" not in ontology:
-        ontology["owners"] = {}
-
-    if owner_name in ontology["owners"]:
+    if not ontology_store.add_owner(owner_name, {"note": "new owner added"}):
         print(f"⚠️ 車主 {owner_name} 已存在。")
         return
 
-    ontology["owners"][owner_name] = {"note": "new owner added"}
-    save_ontology(ontology)
     print(f"✅ 已新增車主：{owner_name}")
 
+# --- 把事件記錄合併回快照（ontology.yaml 或 ontology.db）---
+def compact_events():
+    merged = ontology_store.compact()
+    print(f"🗜️ 已合併 {merged} bytes 的事件記錄到 {os.path.basename(ontology_store.path)}。")
+
 # --- 主程式互動 ---
 if __name__ == "__main__":
+    # 大量匯入：python event_input_level2.py --bulk events.csv [errors.csv]（或 .jsonl），每批一次寫入
+    if len(sys.argv) >= 3 and sys.argv[1] == "--bulk":
+        ingest_file(ontology_store, sys.argv[2], errors_path=sys.argv[3] if len(sys.argv) > 3 else None)
+        sys.exit()
+
     print("🚗 Ontology Event Input 模擬器（Level-2 版）")
     print("選擇操作：")
     print("1️⃣ 新增車輛")
     print("2️⃣ 更新車牌狀態")
     print("3️⃣ 新增車主")
-    choice = input("請輸入 1 / 2 / 3：").strip()
+    print("4️⃣ 合併事件記錄")
+    choice = input("請輸入 1 / 2 / 3 / 4：").strip()
 
     if choice == "1":
         plate = input("輸入車牌號碼：").strip()
@@ -79,6 +74,8 @@ if __name__ == "__main__":
     elif choice == "3":
         owner = input("輸入車主姓名：").strip()
         add_owner(owner)
+    elif choice == "4":
+        compact_events()
     else:
         print("❌ 無效選項。")
 
@@ -1,19 +1,28 @@
 import os
-import yaml
+import re
+import sys
 from dotenv import load_dotenv
 import google.generativeai as genai
 from google.generativeai.types import Tool, FunctionDeclaration
 
+# 共用模組放在上一層 ontology/ 資料夾
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ontology_store import get_store
+
 # --- 初始化 ---
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 ONTOLOGY_PATH = "ontology.yaml"
+ontology_store = get_store(ONTOLOGY_PATH)
+
+# 高風險車主的判定來自 ontology.yaml 的這條計數規則（門檻改 at_least 即可）
+HIGH_RISK_RULE = "high_risk_owner"
 
 # --- 輔助函式：讀 ontology ---
 def load_ontology():
-    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    """檔案沒變就直接回傳已解析的資料（唯讀，請勿修改）"""
+    return ontology_store.get()
 
 # --- 查單車輛 ---
 def query_ontology(plate: str):
@@ -27,63 +36,144 @@ def query_ontology(plate: str):
         f"({plate}, type, {v.get('type', 'unknown')})",
         f"({plate}, owner, {v.get('owner', 'unknown')})",
     ]
-    return {"found": True, "facts": facts}
+    # 規則引擎已判定的結果（不必再由 LLM 推理）
+    violations = ontology_store.facts.violations(plate)
+    facts += [f"({plate}, violates, {rule})" for rule in violations]
+    return {"found": True, "facts": facts, "violations": violations}
 
-# --- 查詢某車主的所有車 ---
+# --- 查詢某車主的所有車（車主索引，不掃描全部車輛）---
 def query_owner(owner: str):
-    ontology = load_ontology()
-    vehicles = ontology.get("vehicles", {})
-    owned = [
-        (p, v["license_status"]) for p, v in vehicles.items() if v.get("owner") == owner
-    ]
-    return {"found": bool(owned), "vehicles": owned}
+    vehicles = load_ontology().get("vehicles", {})
+    index = ontology_store.index
+    owned = [(p, vehicles[p].get("license_status", "unknown")) for p in index.plates_of(owner)]
+    rules = [{"rule": name, "count": n, "holds": holds} for name, n, holds in ontology_store.facts.group_facts(owner)]
+    high_risk = any(r["holds"] for r in rules if r["rule"] == HIGH_RISK_RULE)
+    return {"found": bool(owned), "vehicles": owned, "expired_count": index.expired_of(owner),
+            "high_risk": high_risk, "rules": rules}
+
+# --- 規則引擎直接判定：問題中提到的車牌 / 車主 ---
+# 只有「某台車有沒有違規」「某位車主是不是高風險」這類問題能完全由規則判定回答；
+# 問到清單、數量等其他資訊時交給 function calling
+VERDICT_WORDS = ("違規", "違反", "高風險", "風險", "規則")
+OTHER_WORDS = ("哪些", "哪幾", "幾台", "多少", "列出", "所有", "清單", "誰")
+
+def mentioned_owners(question: str):
+    """問題中出現的已知車主：英數詞，以及中文字串中 2～4 字的片段（中文姓名沒有空白分隔）"""
+    index = ontology_store.index
+    tokens = re.findall(r"[A-Za-z0-9_]+", question)
+    for run in re.findall(r"[\u4e00-\u9fff]+", question):
+        tokens += [run[i:j] for i in range(len(run)) for j in range(i + 2, min(i + 4, len(run)) + 1)]
+    return [t for t in dict.fromkeys(tokens) if index.plates_of(t)]
+
+def rule_verdicts(question: str):
+    """問題只問到規則判定時回傳已判定的事實（字串清單），其餘情況回傳 None（改用 tools 查詢）"""
+    if not any(w in question for w in VERDICT_WORDS) or any(w in question for w in OTHER_WORDS):
+        return None
+    vehicles = load_ontology().get("vehicles", {})
+    facts, index = ontology_store.facts, ontology_store.index
+    plates = [t.upper() for t in dict.fromkeys(re.findall(r"[A-Za-z0-9]+", question)) if t.upper() in vehicles]
+    owners = mentioned_owners(question)
+    if "車主" in question:
+        # 「ABC123 的車主是高風險嗎？」→ 連同該車車主的判定一起給
+        owners += [o for o in dict.fromkeys(vehicles[p].get("owner") for p in plates) if o and o not in owners]
+    if not plates and not owners:
+        return None
+
+    lines = []
+    for plate in plates:
+        lines += query_ontology(plate)["facts"]
+        broken = [f"結論：{plate} 違反 {r}（{facts.rules[r].description.rstrip('。.')}）" for r in facts.violations(plate)]
+        lines += broken or [f"結論：{plate} 沒有違反任何規則"]
+    for owner in owners:
+        lines.append(f"({owner}, owns, {', '.join(index.plates_of(owner))})")
+        for name, n, holds in facts.group_facts(owner):
+            lines.append(f"結論：{owner} {'符合' if holds else '不符合'} {name}"
+                         f"（{facts.rules[name].explain()}；符合 {facts.rules[name].count} 的車輛 {n} 台）")
+    return lines
+
+# --- 列出所有高風險車主 ---
+def query_high_risk_owners():
+    facts = ontology_store.facts
+    owners = facts.group_counts(HIGH_RISK_RULE) if HIGH_RISK_RULE in facts.rules else []
+    return {"found": bool(owners), "owners": [{"owner": o, "expired_count": n} for o, n in owners]}
 
 # --- 定義 Tool ---
-tools = [
-    Tool(function_declarations=[
-        FunctionDeclaration(
-            name="query_ontology",
-            description="查詢單一車輛的 ontology facts。",
-            parameters={
-                "type": "object",
-                "properties": {
-                    "plate": {"type": "string", "description": "車牌號碼，如 ABC123"}
-                },
-                "required": ["plate"]
-            }
-        ),
-        FunctionDeclaration(
-            name="query_owner",
-            description="查詢某位車主擁有哪些車輛與狀態。",
-            parameters={
-                "type": "object",
-                "properties": {
-                    "owner": {"type": "string", "description": "車主姓名"}
-                },
-                "required": ["owner"]
-            }
-        )
-    ])
-]
+# 規則相關的說明一律由編譯後的規則產生（改 ontology.yaml 的 at_least 後不會和工具說明矛盾）
+def rules_text(facts):
+    return "\n".join(f"{i}. {r.explain()}" for i, r in enumerate([*facts.vehicle_rules, *facts.count_rules], 1))
+
+def build_tools(facts):
+    high_risk = facts.rules.get(HIGH_RISK_RULE)
+    criterion = f"（{high_risk.explain()}）" if high_risk is not None else ""
+    return [
+        Tool(function_declarations=[
+            FunctionDeclaration(
+                name="query_ontology",
+                description="查詢單一車輛的 ontology facts。",
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "plate": {"type": "string", "description": "車牌號碼，如 ABC123"}
+                    },
+                    "required": ["plate"]
+                }
+            ),
+            FunctionDeclaration(
+                name="query_owner",
+                description="查詢某位車主擁有哪些車輛與狀態。",
+                parameters={
+                    "type": "object",
+                    "properties": {
+                        "owner": {"type": "string", "description": "車主姓名"}
+                    },
+                    "required": ["owner"]
+                }
+            ),
+            FunctionDeclaration(
+                name="query_high_risk_owners",
+                description=f"列出所有高風險車主{criterion}與其符合的車輛數。",
+                parameters={"type": "object", "properties": {}}
+            )
+        ])
+    ]
 
 # --- 建立模型 ---
-model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",
-    tools=tools
-)
+# 帶 tools 的模型在每個問題開始時依目前的規則建立（建立本身不會呼叫 API）
+def build_model(facts):
+    return genai.GenerativeModel(model_name="gemini-2.0-flash", tools=build_tools(facts))
+
+# 結論已由規則引擎判定時只需要措辭，不需要 tools
+phrasing_model = genai.GenerativeModel(model_name="gemini-2.0-flash")
 
 SYSTEM_PROMPT = """
 你是一個交通助理 Agent。
-你可以呼叫 query_ontology() 或 query_owner() 來查詢 ontology.yaml。
+你可以呼叫 query_ontology()、query_owner() 或 query_high_risk_owners() 來查詢 ontology.yaml。
 規則：
-1. 若 license_status == "expired" → 該車輛違規。
-2. 若同一車主有兩台以上 expired 車 → 該車主為高風險。
+{rules}
+工具回傳的 violations / rules 欄位已由規則引擎判定，請直接採用。
 請以中文回答。
 """
 
+PHRASE_PROMPT = """
+你是一個交通助理 Agent。以下結論已由規則引擎依 ontology 判定，請直接採用，不要重新推理或更改結論，
+只需用自然的中文回答使用者的問題。
+已判定的事實：
+{facts}
+使用者問題：{question}
+"""
+
 def chat_with_llm(question: str):
-    chat = model.start_chat(history=[])
-    response = chat.send_message(f"{SYSTEM_PROMPT}\n使用者問題：{question}")
+    verdicts = rule_verdicts(question)
+    if verdicts:
+        # 結論是確定的，LLM 只負責把它說成自然語言（一次生成，沒有 function call 來回）
+        print(f"⚡ 規則引擎判定：{len(verdicts)} 條事實")
+        response = phrasing_model.generate_content(
+            PHRASE_PROMPT.format(facts="\n".join(verdicts), question=question))
+        return response.text.strip()
+
+    facts = ontology_store.facts
+    chat = build_model(facts).start_chat(history=[])
+    response = chat.send_message(f"{SYSTEM_PROMPT.format(rules=rules_text(facts))}\n使用者問題：{question}")
 
     for part in response.candidates[0].content.parts:
         fn_call = getattr(part, "function_call", None)
@@ -99,6 +189,8 @@ def chat_with_llm(question: str):
             result = query_ontology(fn_args["plate"])
         elif fn_name == "query_owner" and "owner" in fn_args:
             result = query_owner(fn_args["owner"])
+        elif fn_name == "query_high_risk_owners":
+            result = query_high_risk_owners()
         else:
             result = {"error": "Unknown function or missing args."}
 
@@ -1,4 +1,5 @@
 import os
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -23,7 +24,22 @@ content = "本次會議的重點如下： \n \
 *   **市場策略研討：** 針對新產品的市場策略進行了深入討論。 \n \
 *   **預算分配確認：** 正式確認了下個季度的預算分配方案。 \n \
 *   **團隊建設規劃：** 規劃並確定了團隊建設活動的時間與地點。 "
-response = model.generate_content("你是一個會議側寫員，請幫我總結這次會議的重點，格式為 JSON。會議內容如下：\n" + content)
+start = time.perf_counter()
+first_token = None
+response = model.generate_content("你是一個會議側寫員，請幫我總結這次會議的重點，格式為 JSON。會議內容如下：\n" + content, stream=True)
 
-# 輸出結果
-print("🤖 Gemini 回覆：", response.text)
\ No newline at end of file
+# 輸出結果（收到一段印一段）
+print("🤖 Gemini 回覆：", end=" ", flush=True)
+for chunk in response:
+    try:
+        text = chunk.text
+    except ValueError:
+        # 沒有文字的片段（例如只帶 finish_reason / 安全評分）
+        continue
+    if not text:
+        continue
+    if first_token is None:
+        first_token = time.perf_counter() - start
+    print(text, end="", flush=True)
+total = time.perf_counter() - start
+print(f"\n⏱️ 首字延遲 {first_token if first_token is not None else total:.2f}s，總生成時間 {total:.2f}s")
\ No newline at end of file
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -31,13 +32,30 @@ prompt = f"""
 {transcript}
 """
 
-# 5️⃣ 呼叫 Gemini 模型
-response = model.generate_content(prompt)
+# 5️⃣ 呼叫 Gemini 模型（串流：先把收到的內容即時印出）
+start = time.perf_counter()
+first_token = None
+parts = []
+print("\n⏳ 模型輸出中：")
+for chunk in model.generate_content(prompt, stream=True):
+    try:
+        text = chunk.text
+    except ValueError:
+        # 沒有文字的片段（例如只帶 finish_reason / 安全評分）
+        continue
+    if not text:
+        continue
+    if first_token is None:
+        first_token = time.perf_counter() - start
+    parts.append(text)
+    print(text, end="", flush=True)
+total = time.perf_counter() - start
+print(f"\n⏱️ 首字延遲 {first_token if first_token is not None else total:.2f}s，總生成時間 {total:.2f}s\n")
+raw_text = "".join(parts).strip()
 
 # 6️⃣ 嘗試解析 LLM 的輸出
 try:
     # 部分模型會意外加上 ```json ... ``` 包裝，可清理
-    raw_text = response.text.strip()
     cleaned = raw_text.replace("```json", "").replace("```", "").strip()
     output_data = json.loads(cleaned)
 
@@ -50,4 +68,4 @@ try:
 
 except json.JSONDecodeError:
     print("⚠️ 模型輸出不是有效 JSON，請檢查輸出內容：")
-    print(response.text)
+    print(raw_text)
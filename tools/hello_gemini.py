@@ -1,4 +1,5 @@
 import os
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -18,9 +19,25 @@ genai.configure(api_key=api_key)
 # 初始化模型
 model = genai.GenerativeModel("gemini-2.5-flash")
 
-# 發送 prompt
-response = model.generate_content("Hello from Gemini! 用繁體中文打招呼")
-
-# 輸出結果
-print("🤖 Gemini 回覆：", response.text)
+# 發送 prompt（串流模式：邊生成邊回傳）
+start = time.perf_counter()
+first_token = None
+print("🤖 Gemini 回覆：", end=" ", flush=True)
+for chunk in model.generate_content("Hello from Gemini! 用繁體中文打招呼", stream=True):
+    try:
+        text = chunk.text
+    except ValueError:
+        # 沒有文字的片段（例如只帶 finish_reason / 安全評分）
+        continue
+    if not text:
+        continue
+    if first_token is None:
+        first_token = time.perf_counter() - start
+    print(text, end="", flush=True)
+
+# 輸出首字延遲與總時間（完全沒有文字時首字延遲以總時間計）
+total = time.perf_counter() - start
+if first_token is None:
+    first_token = total
+print(f"\n⏱️ 首字延遲 {first_token:.2f}s，總生成時間 {total:.2f}s")
 